@@ -0,0 +1,82 @@
+"""
+Time the authentication of a request, get_current_user and get_current_client, with --users logged in users:
+the former lookup of the user by an unindexed session_token followed by the lazy load of its client, the same
+with the index of migration 008, the single joined query of a SessionTokenCache miss and a cache hit. Every
+lookup starts from an empty identity map, as a request does. Everything is rolled back.
+
+Usage (needs the database from docker-compose):
+    python -m mply_ingester.benchmarks.authenticated_request --users 100000 --requests 2000
+"""
+import argparse
+import random
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from mply_ingester.benchmarks.base import create_benchmark_client, make_config_broker, print_result, timer
+from mply_ingester.db.models import User
+from mply_ingester.web.dependencies import get_current_client, get_current_user
+from mply_ingester.web.session_cache import SessionTokenCache
+
+
+def fill_users(session: Session, client_id: int, num_users: int) -> list[str]:
+    """Log in num_users new users of the client, returns their session tokens"""
+    return session.scalars(text("""
+        INSERT INTO users (client_id, email, full_name, created_on, password_hash, session_token)
+        SELECT :client_id, 'benchmark-' || g || '-' || :client_id || '@example.com', 'User ' || g,
+               CURRENT_TIMESTAMP, '', md5(random()::text) || md5(g::text)
+        FROM generate_series(1, :num_users) g
+        RETURNING session_token
+    """), {'client_id': client_id, 'num_users': num_users}).all()
+
+
+def former_lookup(session: Session, token: str) -> None:
+    user = session.query(User).filter(User.session_token == token, User.active == True).first()
+    assert user.client is not None
+
+
+def run(name: str, session: Session, tokens: list[str], authenticate) -> None:
+    with timer() as elapsed:
+        for token in tokens:
+            authenticate(token)
+            session.expunge_all()
+    print_result(name, len(tokens), elapsed[0], 'requests')
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--users', type=int, default=100000)
+    arg_parser.add_argument('--requests', type=int, default=2000)
+    args = arg_parser.parse_args()
+
+    config_broker = make_config_broker()
+    client_id = create_benchmark_client(config_broker)
+    session = config_broker.get_session()
+    try:
+        all_tokens = fill_users(session, client_id, args.users)
+        session.execute(text("ANALYZE users"))
+        tokens = [random.choice(all_tokens) for _ in range(args.requests)]
+
+        def authenticate(session_cache):
+            def run_dependencies(token):
+                user = get_current_user(None, token, session, session_cache)
+                assert get_current_client(user).id == client_id
+            return run_dependencies
+
+        session.execute(text("DROP INDEX users_session_token_idx"))
+        run("former, no index", session, tokens, lambda token: former_lookup(session, token))
+        session.execute(text("CREATE INDEX users_session_token_idx ON users (session_token) "
+                             "WHERE session_token IS NOT NULL"))
+        run("former, index", session, tokens, lambda token: former_lookup(session, token))
+        run("cache miss, index", session, tokens, authenticate(SessionTokenCache(0, 60)))
+
+        session_cache = SessionTokenCache(len(tokens), 60)
+        run("cache warm up", session, tokens, authenticate(session_cache))
+        run("cache hit", session, tokens, authenticate(session_cache))
+    finally:
+        session.rollback()
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import csv
+import io
+import os
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from mply_ingester.config import ConfigBroker
+from mply_ingester.db.models import Client
+
+
+def make_config_broker(**overrides: Any) -> ConfigBroker:
+    """Create a ConfigBroker with the given settings layered on top of the usual config files."""
+    with tempfile.NamedTemporaryFile('w', suffix='.py', delete=False) as f:
+        for key, value in overrides.items():
+            f.write(f"{key} = {value!r}\n")
+    try:
+        return ConfigBroker([f.name])
+    finally:
+        os.unlink(f.name)
+
+
+def create_benchmark_client(config_broker: ConfigBroker) -> int:
+    """Create a throwaway client so benchmark runs never touch real data. Returns its id."""
+    session = config_broker.get_session()
+    try:
+        client = Client(company_name=f"Benchmark {uuid.uuid4().hex[:8]}", address="Benchmark", active=True)
+        session.add(client)
+        session.commit()
+        return client.id
+    finally:
+        session.close()
+
+
+def generate_csv(num_rows: int, title_prefix: str = "Product") -> bytes:
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=["sku", "title", "brand", "stock", "price", "active"])
+    writer.writeheader()
+    for i in range(num_rows):
+        writer.writerow({
+            "sku": f"SKU{i:08d}",
+            "title": f"{title_prefix} {i}",
+            "brand": f"Brand {i % 100}",
+            "stock": str(i % 1000),
+            "price": f"${i % 500},{i % 100:02d}.99",
+            "active": "1" if i % 7 else "0",
+        })
+    return output.getvalue().encode("utf-8")
+
+
+CSV_COLUMN_MAPPING = {
+    "sku": ("sku", "text"),
+    "title": ("title", "text"),
+    "brand": ("brand", "text"),
+    "stock": ("stock_quantity", "integer"),
+    "price": ("reference_price", "decimal"),
+    "active": ("active", "boolean"),
+}
+
+
+@contextmanager
+def timer() -> Iterator[list]:
+    """Measure the wall clock time of the block, the elapsed seconds are appended to the yielded list."""
+    elapsed = []
+    start = time.perf_counter()
+    yield elapsed
+    elapsed.append(time.perf_counter() - start)
+
+
+def print_result(name: str, count: int, seconds: float, unit: str = 'rows') -> None:
+    print(f"{name:<40} {count:>10} {unit} {seconds:>9.3f} s {count / seconds:>12.0f} {unit}/s")
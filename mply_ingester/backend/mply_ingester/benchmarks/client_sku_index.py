@@ -0,0 +1,103 @@
+"""
+Benchmark of the (client_id, sku) indexes on client_products: fills the table up to --total-rows products spread
+over benchmark clients, then times SKU lookups, the product list query and a full update ingest of one client,
+first with the indexes and then with them dropped inside a transaction that is rolled back.
+
+Usage (needs the database from docker-compose, the first run takes a while to fill the table):
+    python -m mply_ingester.benchmarks.client_sku_index --total-rows 10000000
+"""
+import argparse
+import random
+import statistics
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+from mply_ingester.benchmarks.base import make_config_broker, print_result, timer
+from mply_ingester.config import ConfigBroker
+from mply_ingester.db.models import Client, ClientProduct
+
+INDEXES = ['client_products_client_id_sku_key', 'client_products_client_id_sku_id_idx']
+
+
+def fill_products(session: Session, total_rows: int, rows_per_client: int) -> None:
+    missing = total_rows - session.scalar(select(func.count()).select_from(ClientProduct))
+    num_clients = -(-missing // rows_per_client)
+    if num_clients <= 0:
+        return
+    print(f"adding {num_clients * rows_per_client} products for {num_clients} benchmark clients")
+    client_ids = session.scalars(text("""
+        INSERT INTO clients (company_name, address)
+        SELECT 'Benchmark ' || g, 'Benchmark' FROM generate_series(1, :num_clients) g
+        RETURNING id
+    """), {'num_clients': num_clients}).all()
+    session.execute(text("""
+        INSERT INTO client_products (client_id, sku, title, brand, stock_quantity, reference_price, active)
+        SELECT c.id, 'SKU' || lpad(g::text, 8, '0'), 'Product ' || g, 'Brand ' || g % 100, g % 1000, g % 500, true
+        FROM unnest(CAST(:client_ids AS integer[])) c(id), generate_series(1, :rows_per_client) g
+    """), {'client_ids': client_ids, 'rows_per_client': rows_per_client})
+    session.execute(text("ANALYZE client_products"))
+    session.commit()
+
+
+def median_ms(run, repeat: int) -> float:
+    latencies = []
+    for _ in range(repeat):
+        with timer() as elapsed:
+            run()
+        latencies.append(elapsed[0])
+    return statistics.median(latencies) * 1000
+
+
+def measure(config_broker: ConfigBroker, session: Session, client: Client, rows_per_client: int,
+            ingest_rows: int) -> None:
+    def lookup():
+        sku = f"SKU{random.randint(1, rows_per_client):08d}"
+        session.execute(select(ClientProduct.id).where(ClientProduct.client_id == client.id,
+                                                       ClientProduct.sku == sku)).all()
+
+    def list_products():
+        session.execute(select(ClientProduct).where(ClientProduct.client_id == client.id)
+                        .order_by(ClientProduct.sku).offset(100).limit(5)).all()
+
+    print(f"  sku lookup: median {median_ms(lookup, 200):.2f} ms")
+    print(f"  product list: median {median_ms(list_products, 50):.2f} ms")
+
+    # Half of the SKUs exist, the other half are new, and the products not in the file are deactivated
+    records = [{'sku': f"SKU{i:08d}", 'title': f"Updated {i}", 'active': True}
+               for i in range(rows_per_client - ingest_rows // 2, rows_per_client + ingest_rows // 2)]
+    writer = config_broker.get_writer('bulk', session, client)
+    with timer() as elapsed:
+        writer.write(iter(records), full_update=True)
+    print_result("  full update ingest", ingest_rows, elapsed[0])
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--total-rows', type=int, default=10000000)
+    arg_parser.add_argument('--rows-per-client', type=int, default=100000)
+    arg_parser.add_argument('--ingest-rows', type=int, default=20000)
+    args = arg_parser.parse_args()
+
+    config_broker = make_config_broker(INGEST_COPY_THRESHOLD=None)
+    session = config_broker.get_session()
+    try:
+        fill_products(session, args.total_rows, args.rows_per_client)
+        client_id = session.scalar(
+            select(ClientProduct.client_id).group_by(ClientProduct.client_id)
+            .having(func.count() >= args.rows_per_client).order_by(ClientProduct.client_id.desc()).limit(1)
+        )
+        client = session.get(Client, client_id)
+
+        for name, dropped in (('with indexes', []), ('without indexes', INDEXES)):
+            print(name)
+            for index in dropped:
+                session.execute(text(f"DROP INDEX {index}"))
+            measure(config_broker, session, client, args.rows_per_client, args.ingest_rows)
+            session.rollback()
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
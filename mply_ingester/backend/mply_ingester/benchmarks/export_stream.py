@@ -0,0 +1,51 @@
+"""
+Benchmark of the streaming product export: fills a benchmark client with --rows products and runs the export in
+every format, printing the time to the first chunk, the throughput and the peak memory traced while exporting.
+
+Usage (needs the database from docker-compose):
+    python -m mply_ingester.benchmarks.export_stream --rows 1000000
+"""
+import argparse
+import time
+import tracemalloc
+
+from mply_ingester.benchmarks.base import create_benchmark_client, make_config_broker, print_result
+from mply_ingester.benchmarks.product_search import fill_client
+from mply_ingester.web.export import export_products
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--rows', type=int, default=1000000)
+    args = arg_parser.parse_args()
+
+    config_broker = make_config_broker()
+    client_id = create_benchmark_client(config_broker)
+    session = config_broker.get_session()
+    try:
+        fill_client(session, client_id, args.rows)
+    finally:
+        session.close()
+
+    for export_format, gzip in (('csv', False), ('ndjson', False), ('csv', True)):
+        name = export_format + (' gzip' if gzip else '')
+        tracemalloc.start()
+        try:
+            start = time.perf_counter()
+            first_chunk = None
+            size = 0
+            for chunk in export_products(config_broker, client_id, export_format, gzip):
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - start
+                size += len(chunk)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        print_result(name, args.rows, elapsed)
+        print(f"  first chunk after {first_chunk * 1000:.1f} ms, {size / 1024 ** 2:.1f} MiB sent, "
+              f"peak memory {peak / 1024 ** 2:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Time the deactivation step of a full update: a client with --rows products gets a full update that leaves out
+one product in a hundred. Compares the former NOT IN over every ingested SKU with the ingested SKUs table and
+anti-join of the writers. Every run is rolled back.
+
+Usage (needs the database from docker-compose):
+    python -m mply_ingester.benchmarks.full_update_deactivation --rows 1000000
+"""
+import argparse
+from typing import Iterable, List
+
+from sqlalchemy import func, select
+
+from mply_ingester.benchmarks.base import create_benchmark_client, make_config_broker, print_result, timer
+from mply_ingester.benchmarks.product_search import fill_client
+from mply_ingester.db.models import Client, ClientProduct
+from mply_ingester.ingestion.base import Record
+from mply_ingester.ingestion.writers import BulkUpsertWriter, WriteResult
+
+
+class DeactivateOnlyWriter(BulkUpsertWriter):
+    """Skips the upserts, so that only the collection of the SKUs and the deactivation are timed"""
+
+    def upsert(self, records: Iterable[Record]) -> WriteResult:
+        return WriteResult(processed_count=sum(1 for _ in records))
+
+
+def deactivate_not_in(session, client_id: int, ingested_skus: List[str]) -> int:
+    last_existing_id = session.scalar(select(func.max(ClientProduct.id)).where(ClientProduct.client_id == client_id))
+    return session.query(ClientProduct).filter(
+        ClientProduct.client_id == client_id,
+        ClientProduct.id <= last_existing_id,
+        ClientProduct.sku.isnot(None),
+        ~ClientProduct.sku.in_(set(ingested_skus))
+    ).update({'active': False, 'last_changed_on': func.current_timestamp()}, synchronize_session=False)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--rows', type=int, default=1000000)
+    args = arg_parser.parse_args()
+
+    config_broker = make_config_broker()
+    client_id = create_benchmark_client(config_broker)
+    session = config_broker.get_session()
+    try:
+        fill_client(session, client_id, args.rows)
+        ingested_skus = [f"SKU{i:08d}" for i in range(1, args.rows + 1) if i % 100]
+
+        with timer() as elapsed:
+            deactivated = deactivate_not_in(session, client_id, ingested_skus)
+        session.rollback()
+        print_result(f"NOT IN: {deactivated} deactivated", len(ingested_skus), elapsed[0], 'skus')
+
+        writer = DeactivateOnlyWriter(config_broker, session, session.get(Client, client_id))
+        with timer() as elapsed:
+            result = writer.write(({'sku': sku} for sku in ingested_skus), full_update=True)
+        session.rollback()
+        print_result(f"anti-join: {result.deactivated_count} deactivated", len(ingested_skus), elapsed[0], 'skus')
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Compare the rows/second of the ingest writers, for a file of new products, for the same file re-ingested as an
+update of existing products (dry run first) and for that update sent again unchanged. Parsing runs in turn with the writes
+(pipeline depth 0) or ahead of them.
+
+Usage (needs the database from docker-compose):
+    python -m mply_ingester.benchmarks.ingest_throughput --rows 20000 --writers row bulk copy --pipeline-depths 0 4
+"""
+import argparse
+
+from mply_ingester.benchmarks.base import (CSV_COLUMN_MAPPING, create_benchmark_client, generate_csv,
+                                           make_config_broker, print_result, timer)
+from mply_ingester.db.models import Client
+from mply_ingester.ingestion.base import ParserConfig
+from mply_ingester.ingestion.service import DataIngestionService
+
+
+def run_ingest(config_broker, client_id: int, parser_config: ParserConfig, data: bytes, dry_run: bool = False) -> float:
+    session = config_broker.get_session()
+    try:
+        client = session.get(Client, client_id)
+        with timer() as elapsed:
+            report = DataIngestionService(config_broker, session, client).ingest_data(parser_config, data, dry_run=dry_run)
+        assert report.success, report.message
+        timings = report.stats['timings']
+        print(f"  parse {timings['parse_seconds']:.3f} s, write {timings['write_seconds']:.3f} s")
+        return elapsed[0]
+    finally:
+        session.close()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--rows', type=int, default=20000)
+    arg_parser.add_argument('--writers', nargs='+', default=['row', 'bulk', 'copy'])
+    arg_parser.add_argument('--pipeline-depths', nargs='+', type=int, default=[4])
+    args = arg_parser.parse_args()
+
+    parser_config = ParserConfig(parser_id='csv', column_mapping=CSV_COLUMN_MAPPING)
+    create_data = generate_csv(args.rows)
+    update_data = generate_csv(args.rows, title_prefix="Updated product")
+
+    for writer_id in args.writers:
+        for depth in args.pipeline_depths:
+            config_broker = make_config_broker(INGEST_WRITER=writer_id, INGEST_COPY_THRESHOLD=None,
+                                               INGEST_PIPELINE_DEPTH=depth)
+            client_id = create_benchmark_client(config_broker)
+            name = f"{writer_id}, depth {depth}"
+            print_result(f"{name}: create", args.rows, run_ingest(config_broker, client_id, parser_config, create_data))
+            print_result(f"{name}: dry run update", args.rows,
+                         run_ingest(config_broker, client_id, parser_config, update_data, dry_run=True))
+            print_result(f"{name}: update", args.rows, run_ingest(config_broker, client_id, parser_config, update_data))
+            print_result(f"{name}: unchanged", args.rows, run_ingest(config_broker, client_id, parser_config, update_data))
+
+
+if __name__ == "__main__":
+    main()
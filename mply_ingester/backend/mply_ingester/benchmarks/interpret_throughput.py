@@ -0,0 +1,70 @@
+"""
+Benchmark of row interpretation on a wide CSV: every parsed item interpreted element by element through
+ParsedItem.interpret, against the column mapping compiled into a ColumnMappingPlan once per ingest and applied
+row by row, or column by column with the transformers' transform_many.
+
+Usage:
+    python -m mply_ingester.benchmarks.interpret_throughput --rows 100000 --columns 40
+"""
+import argparse
+import csv
+import io
+
+from mply_ingester.benchmarks.base import print_result, timer
+from mply_ingester.config import ConfigBroker
+from mply_ingester.ingestion.base import ColumnMappingPlan
+
+TARGETS = [('sku', 'text'), ('title', 'text'), ('brand', 'text'), ('stock_quantity', 'integer'),
+           ('reference_price', 'decimal'), ('active', 'boolean')]
+VALUES = {'text': 'some text', 'integer': '12', 'decimal': '$1,234.50', 'boolean': 'yes'}
+
+
+def generate_wide_csv(num_rows: int, num_columns: int) -> tuple[bytes, dict]:
+    column_mapping = {f'col{i}': TARGETS[i % len(TARGETS)] for i in range(num_columns)}
+    row = ','.join(f'"{VALUES[transformer]}"' for _, transformer in column_mapping.values())
+    data = ','.join(column_mapping) + '\n' + (row + '\n') * num_rows
+    return data.encode('utf-8'), column_mapping
+
+
+def item_by_item(config_broker: ConfigBroker, data: bytes, column_mapping: dict) -> float:
+    parser = config_broker.get_parser('csv')
+    with timer() as elapsed:
+        for item in parser.parse_client_data(io.BytesIO(data)):
+            item.interpret(config_broker, column_mapping)
+            {element.column_name: element.value for element in item.elements}
+    return elapsed[0]
+
+
+def plan_row_by_row(config_broker: ConfigBroker, data: bytes, column_mapping: dict) -> float:
+    plan = ColumnMappingPlan.compile(config_broker, column_mapping)
+    with timer() as elapsed:
+        rows = csv.reader(io.StringIO(data.decode('utf-8')))
+        interpret_row = plan.bind(next(rows))
+        for row in rows:
+            interpret_row(row)
+    return elapsed[0]
+
+
+def plan_column_by_column(config_broker: ConfigBroker, data: bytes, column_mapping: dict) -> float:
+    parser = config_broker.get_parser('csv')
+    with timer() as elapsed:
+        for _ in parser.process_client_data(io.BytesIO(data), column_mapping):
+            pass
+    return elapsed[0]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--rows', type=int, default=100000)
+    arg_parser.add_argument('--columns', type=int, default=40)
+    args = arg_parser.parse_args()
+
+    config_broker = ConfigBroker([])
+    data, column_mapping = generate_wide_csv(args.rows, args.columns)
+    for name, run in (('item by item', item_by_item), ('plan, row by row', plan_row_by_row),
+                      ('plan, column by column', plan_column_by_column)):
+        print_result(name, args.rows, run(config_broker, data, column_mapping))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Load test: latency of /products/list while another client uploads a large file to /products/ingest.
+
+Starts the app with uvicorn in this process, measures list latency with no other traffic, then again while an
+ingest is running, and prints p50/p99 for both.
+
+Usage (needs the database from docker-compose):
+    python -m mply_ingester.benchmarks.list_latency_under_ingest --rows 200000
+"""
+import argparse
+import json
+import socket
+import statistics
+import threading
+import time
+import uuid
+
+import httpx
+import uvicorn
+
+from mply_ingester.benchmarks.base import CSV_COLUMN_MAPPING, generate_csv, make_config_broker
+from mply_ingester.web.app import make_app
+
+
+def start_server(config_broker) -> tuple[uvicorn.Server, str]:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(make_app(config_broker), host='127.0.0.1', port=port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f'http://127.0.0.1:{port}'
+
+
+def logged_in_client(base_url: str) -> httpx.Client:
+    client = httpx.Client(base_url=base_url, timeout=None)
+    email = f'bench-{uuid.uuid4().hex[:8]}@example.com'
+    client.post('/auth/signup', data={
+        'full_name': 'Benchmark User',
+        'email': email,
+        'password': 'benchmark-password',
+        'company_name': 'Benchmark Co',
+        'company_address': '1 Benchmark Road',
+    }).raise_for_status()
+    client.post('/auth/login', data={'username': email, 'password': 'benchmark-password'}).raise_for_status()
+    return client
+
+
+def list_latencies(client: httpx.Client, until: callable) -> list[float]:
+    latencies = []
+    while not until():
+        start = time.perf_counter()
+        client.get('/products/list', params={'q': 'SKU0001'}).raise_for_status()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def print_latencies(name: str, latencies: list[float]) -> None:
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"{name:<25} {len(latencies):>6} requests  p50 {quantiles[49] * 1000:>8.1f} ms  p99 {quantiles[98] * 1000:>8.1f} ms")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--rows', type=int, default=200000)
+    arg_parser.add_argument('--idle-seconds', type=float, default=3)
+    args = arg_parser.parse_args()
+
+    server, base_url = start_server(make_config_broker())
+    try:
+        ingesting_client = logged_in_client(base_url)
+        listing_client = logged_in_client(base_url)
+        data = generate_csv(args.rows)
+        parser_config = json.dumps({'parser_id': 'csv', 'column_mapping': CSV_COLUMN_MAPPING})
+
+        deadline = time.perf_counter() + args.idle_seconds
+        print_latencies('idle', list_latencies(listing_client, lambda: time.perf_counter() > deadline))
+
+        ingest_done = threading.Event()
+
+        def ingest():
+            try:
+                ingesting_client.post(
+                    '/products/ingest',
+                    data={'parser_config': parser_config},
+                    files={'data_file': ('products.csv', data, 'text/csv')},
+                ).raise_for_status()
+            finally:
+                ingest_done.set()
+
+        ingest_thread = threading.Thread(target=ingest)
+        start = time.perf_counter()
+        ingest_thread.start()
+        print_latencies('during ingest', list_latencies(listing_client, ingest_done.is_set))
+        ingest_thread.join()
+        print(f"ingest of {args.rows} rows took {time.perf_counter() - start:.1f} s")
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
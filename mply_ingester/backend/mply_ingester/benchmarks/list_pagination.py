@@ -0,0 +1,56 @@
+"""
+Benchmark of deep pages of the product list: fills a benchmark client with --rows products, then times fetching
+the page at increasing depths with an offset, and with the keyset cursor of the row before it.
+
+Usage (needs the database from docker-compose):
+    python -m mply_ingester.benchmarks.list_pagination --rows 1000000
+"""
+import argparse
+import statistics
+
+from sqlalchemy import tuple_
+
+from mply_ingester.benchmarks.base import create_benchmark_client, make_config_broker, timer
+from mply_ingester.benchmarks.product_search import fill_client
+from mply_ingester.db.models import ClientProduct
+from mply_ingester.web.search import LISTING_KEYS, decode_cursor, encode_cursor
+
+PAGE_SIZE = 50
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--rows', type=int, default=1000000)
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    args = arg_parser.parse_args()
+
+    config_broker = make_config_broker()
+    client_id = create_benchmark_client(config_broker)
+    session = config_broker.get_session()
+    try:
+        fill_client(session, client_id, args.rows)
+        listing = session.query(ClientProduct).filter(ClientProduct.client_id == client_id).order_by(*LISTING_KEYS)
+
+        def median_ms(query) -> float:
+            latencies = []
+            for _ in range(args.repeat):
+                with timer() as elapsed:
+                    query.limit(PAGE_SIZE).all()
+                latencies.append(elapsed[0])
+            return statistics.median(latencies) * 1000
+
+        depth = PAGE_SIZE
+        while depth < args.rows:
+            previous = session.query(*LISTING_KEYS).filter(ClientProduct.client_id == client_id) \
+                .order_by(*LISTING_KEYS).offset(depth - 1).limit(1).one()
+            after = decode_cursor(encode_cursor(previous), LISTING_KEYS)
+            offset_ms = median_ms(listing.offset(depth))
+            cursor_ms = median_ms(listing.filter(tuple_(*LISTING_KEYS) > tuple_(*after)))
+            print(f"page at row {depth:>9}: offset {offset_ms:>9.2f} ms  cursor {cursor_ms:>7.2f} ms")
+            depth *= 10
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
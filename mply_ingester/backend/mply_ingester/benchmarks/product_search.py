@@ -0,0 +1,90 @@
+"""
+Benchmark of the /products/list search on a single large client: fills a benchmark client with --rows products,
+then times the search query of the plain ILIKE search, and of the pg_trgm search with and without its trigram
+indexes (dropped inside a transaction that is rolled back), and shows the indexes each query plan scans. The
+pg_trgm runs are skipped if the database does not have the extension.
+
+Usage (needs the database from docker-compose, filling the client takes a while):
+    python -m mply_ingester.benchmarks.product_search --rows 5000000
+"""
+import argparse
+import re
+import statistics
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+from mply_ingester.benchmarks.base import create_benchmark_client, make_config_broker, timer
+from mply_ingester.db.models import ClientProduct
+from mply_ingester.web.search import ProductSearch, TrigramProductSearch, product_search_for
+
+TRIGRAM_INDEXES = ['client_products_sku_trgm_idx', 'client_products_title_trgm_idx',
+                   'client_products_remote_id_trgm_idx']
+QUERIES = ['SKU04000017', 'Shiny Widget 123', 'REM-77', 'zzz not there']
+
+
+def fill_client(session: Session, client_id: int, rows: int) -> None:
+    print(f"adding {rows} products")
+    session.execute(text("""
+        INSERT INTO client_products (client_id, sku, remote_id, title, active)
+        SELECT :client_id, 'SKU' || lpad(g::text, 8, '0'), 'REM-' || g,
+               (ARRAY['Shiny', 'Rusty', 'Small', 'Large'])[g % 4 + 1] || ' Widget ' || g, true
+        FROM generate_series(1, :rows) g
+    """), {'client_id': client_id, 'rows': rows})
+    session.execute(text("ANALYZE client_products"))
+    session.commit()
+
+
+def measure(session: Session, client_id: int, search: ProductSearch, repeat: int) -> None:
+    for q in QUERIES:
+        query = session.query(ClientProduct).filter(ClientProduct.client_id == client_id)
+        query = search.filter(query, q).order_by(*search.rank_keys(q)).limit(5)
+        latencies = []
+        for _ in range(repeat):
+            with timer() as elapsed:
+                query.all()
+            latencies.append(elapsed[0])
+        print(f"  q={q!r:<20} median {statistics.median(latencies) * 1000:>9.1f} ms   "
+              f"scans {', '.join(scanned_indexes(session, query)) or 'no index'}")
+
+
+def scanned_indexes(session: Session, query) -> list[str]:
+    """The indexes in the plan of the query"""
+    statement = query.statement.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True})
+    plan = '\n'.join(session.scalars(text(f"EXPLAIN {statement}")))
+    return sorted(set(re.findall(r' on (\w+_(?:idx|key|pkey))', plan)))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--rows', type=int, default=5000000)
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    args = arg_parser.parse_args()
+
+    config_broker = make_config_broker()
+    client_id = create_benchmark_client(config_broker)
+    session = config_broker.get_session()
+    try:
+        fill_client(session, client_id, args.rows)
+
+        print("ILIKE search")
+        measure(session, client_id, ProductSearch(), args.repeat)
+
+        if isinstance(product_search_for(session), TrigramProductSearch):
+            print("pg_trgm search with trigram indexes")
+            measure(session, client_id, TrigramProductSearch(), args.repeat)
+
+            print("pg_trgm search without trigram indexes")
+            for index in TRIGRAM_INDEXES:
+                session.execute(text(f"DROP INDEX {index}"))
+            measure(session, client_id, TrigramProductSearch(), args.repeat)
+            session.rollback()
+        else:
+            print("pg_trgm is not installed, skipping the trigram search")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark of the parsed row types: parse and interpret --rows CSV rows into ParsedItems made of slotted
+dataclasses, and into replicas of the previous pydantic dataclasses, then measure the memory of --held-rows
+parsed rows kept alive at once.
+
+Usage:
+    python -m mply_ingester.benchmarks.row_representation --rows 1000000
+"""
+import argparse
+import csv
+import gc
+import io
+import tracemalloc
+from typing import Any, List
+
+from pydantic.dataclasses import dataclass as pydantic_dataclass
+
+from mply_ingester.benchmarks.base import CSV_COLUMN_MAPPING, generate_csv, print_result, timer
+from mply_ingester.config import ConfigBroker
+from mply_ingester.ingestion.base import ParsedElement, ParsedItem
+
+
+@pydantic_dataclass
+class PydanticParsedElement:
+    column_name: str
+    value: Any
+    is_interpreted: bool = False
+
+
+@pydantic_dataclass
+class PydanticParsedItem:
+    elements: List[PydanticParsedElement]
+
+
+def parse(data: bytes, element_cls, item_cls):
+    reader = csv.reader(io.StringIO(data.decode('utf-8')))
+    header = next(reader)
+    for row in reader:
+        yield item_cls(elements=[element_cls(column_name=c, value=v) for c, v in zip(header, row)])
+
+
+def interpret(config_broker: ConfigBroker, item, element_cls, item_cls):
+    elements = []
+    for element in item.elements:
+        multiply_column_name, transformer_name = CSV_COLUMN_MAPPING[element.column_name]
+        value = config_broker.get_transformer(transformer_name).transform(element.value)
+        elements.append(element_cls(column_name=multiply_column_name, value=value, is_interpreted=True))
+    return item_cls(elements=elements)
+
+
+def parse_and_interpret(config_broker: ConfigBroker, data: bytes, element_cls, item_cls) -> float:
+    with timer() as elapsed:
+        for item in parse(data, element_cls, item_cls):
+            interpret(config_broker, item, element_cls, item_cls)
+    return elapsed[0]
+
+
+def bytes_per_row(data: bytes, element_cls, item_cls) -> float:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        items = list(parse(data, element_cls, item_cls))
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (after - before) / len(items)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--rows', type=int, default=1000000)
+    arg_parser.add_argument('--held-rows', type=int, default=100000)
+    args = arg_parser.parse_args()
+
+    config_broker = ConfigBroker([])
+    data = generate_csv(args.rows)
+    held_data = generate_csv(args.held_rows)
+    for name, element_cls, item_cls in (('pydantic dataclasses', PydanticParsedElement, PydanticParsedItem),
+                                        ('slotted dataclasses', ParsedElement, ParsedItem)):
+        print_result(f"{name}: parse and interpret", args.rows,
+                     parse_and_interpret(config_broker, data, element_cls, item_cls))
+        print(f"{name}: {bytes_per_row(held_data, element_cls, item_cls):.0f} bytes per parsed row held")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Micro-benchmark of the transformer lookup done for every cell: parse and interpret a CSV of --cells cells with
+the ConfigBroker registry, and with the previous lookup that scanned BaseTransformer.__subclasses__() and created
+a new transformer for each cell.
+
+Usage:
+    python -m mply_ingester.benchmarks.transformer_lookup --cells 1000000
+"""
+import argparse
+import io
+
+from mply_ingester.benchmarks.base import print_result, timer
+from mply_ingester.config import ConfigBroker
+from mply_ingester.ingestion.transformers import BaseTransformer
+
+COLUMNS = 10
+
+
+class SubclassScanConfigBroker(ConfigBroker):
+    """The lookup as it was before the registry"""
+
+    def get_transformer(self, transformer_id: str):
+        for cls in BaseTransformer.__subclasses__():
+            if cls.id is not None and cls.id == transformer_id:
+                return cls()
+        raise ValueError(f"Unknown transformer: {transformer_id}")
+
+
+def generate_csv(num_rows: int) -> bytes:
+    lines = [','.join(f'col{i}' for i in range(COLUMNS))]
+    for row in range(num_rows):
+        lines.append(','.join(f'value {row} {i}' for i in range(COLUMNS)))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def run(config_broker: ConfigBroker, data: bytes) -> float:
+    column_mapping = {f'col{i}': ('title', 'text') for i in range(COLUMNS)}
+    parser = config_broker.get_parser('csv')
+    with timer() as elapsed:
+        for _ in parser.process_client_data(io.BytesIO(data), column_mapping):
+            pass
+    return elapsed[0]
+
+
+def lookups_only(config_broker: ConfigBroker, cells: int) -> float:
+    get_transformer = config_broker.get_transformer
+    with timer() as elapsed:
+        for _ in range(cells):
+            get_transformer('boolean')
+    return elapsed[0]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--cells', type=int, default=1000000)
+    args = arg_parser.parse_args()
+
+    data = generate_csv(args.cells // COLUMNS)
+    for name, config_broker in (('subclass scan', SubclassScanConfigBroker([])), ('registry', ConfigBroker([]))):
+        print_result(f"{name}: lookups only", args.cells, lookups_only(config_broker, args.cells), 'cells')
+        print_result(f"{name}: parse and interpret", args.cells, run(config_broker, data), 'cells')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 import importlib.util
 import os
-from typing import Any, Optional
+from typing import Any, Iterator, Optional
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
 
@@ -15,6 +15,11 @@ class ConfigError(Exception):
     """Custom exception for ConfigBroker when attempting to modify read-only config."""
     pass
 
+
+class DuplicateIdError(ConfigError):
+    """Two transformers, parsers or writers declare the same id."""
+    pass
+
 class ConfigBroker:
     """A configuration class that loads settings from Python files and is read-only after initialization."""
 
@@ -33,6 +38,9 @@ class ConfigBroker:
         self._input_files = filepaths_to_use
 
         self._db_engine = None
+        self._registries: dict[str, dict[str, type]] = {}
+        self._transformers: dict[str, Any] = {}
+        self._parsers: dict[str, Any] = {}
 
     def _load_from_file(self, filepath: str) -> None:
         """
@@ -124,23 +132,100 @@ class ConfigBroker:
         if 'DATABASE_URI' not in self._config:
             raise ConfigError("DATABASE_URI not found in config.")
         if self._db_engine is None:
-            self._db_engine = create_engine(self['DATABASE_URI'])
+            # values_plus_batch makes executemany UPDATEs go out in pages instead of one round trip per row
+            self._db_engine = create_engine(self['DATABASE_URI'], executemany_mode='values_plus_batch')
         Session = sessionmaker(bind=self._db_engine)
         return Session()
     
-    def get_transformer(self, transformer_id: str):
+    @staticmethod
+    def _registry_bases() -> dict[str, type]:
         # Import inside the method to avoid circular imports
+        from mply_ingester.ingestion.parsers import ClientDataParser
         from mply_ingester.ingestion.transformers import BaseTransformer
-        for cls in BaseTransformer.__subclasses__():
-            if cls.id is not None and cls.id == transformer_id:
-                return cls()
-        raise ValueError(f"Unknown transformer: {transformer_id}")
+        from mply_ingester.ingestion.writers import BaseProductWriter
+        return {'transformer': BaseTransformer, 'parser': ClientDataParser, 'writer': BaseProductWriter}
+
+    def _registry(self, kind: str) -> dict[str, type]:
+        """
+        Map of id to class for transformers, parsers or writers. Built once per ConfigBroker from every subclass,
+        at any depth, that declares its own id.
+        """
+        if kind not in self._registries:
+            registry = {}
+            for cls in _subclasses_declaring_id(self._registry_bases()[kind]):
+                self._add_to_registry(registry, kind, cls)
+            self._registries[kind] = registry
+        return self._registries[kind]
+
+    @staticmethod
+    def _add_to_registry(registry: dict[str, type], kind: str, cls: type) -> None:
+        if cls.id is None:
+            raise ConfigError(f"Cannot register {kind} {cls.__qualname__} without an id")
+        existing = registry.get(cls.id)
+        if existing is not None and existing is not cls:
+            raise DuplicateIdError(
+                f"Duplicate {kind} id '{cls.id}': {existing.__module__}.{existing.__qualname__} "
+                f"and {cls.__module__}.{cls.__qualname__}"
+            )
+        registry[cls.id] = cls
+
+    def _register(self, kind: str, cls: type) -> type:
+        base = self._registry_bases()[kind]
+        if not issubclass(cls, base):
+            raise ConfigError(f"{cls.__qualname__} is not a subclass of {base.__qualname__}")
+        self._add_to_registry(self._registry(kind), kind, cls)
+        return cls
+
+    def register_transformer(self, cls: type) -> type:
+        """Explicitly register a transformer class, e.g. one defined after the first lookup"""
+        return self._register('transformer', cls)
+
+    def register_parser(self, cls: type) -> type:
+        """Explicitly register a parser class, e.g. one defined after the first lookup"""
+        return self._register('parser', cls)
+
+    def register_writer(self, cls: type) -> type:
+        """Explicitly register a writer class, e.g. one defined after the first lookup"""
+        return self._register('writer', cls)
+
+    def get_transformer(self, transformer_id: str):
+        """Return the shared instance of a transformer. This runs for every cell, so the hit is a single dict lookup."""
+        try:
+            return self._transformers[transformer_id]
+        except KeyError:
+            pass
+        try:
+            cls = self._registry('transformer')[transformer_id]
+        except KeyError:
+            raise ValueError(f"Unknown transformer: {transformer_id}") from None
+        transformer = self._transformers[transformer_id] = cls()
+        return transformer
 
     def get_parser(self, parser_id: str):
-        # Import inside the method to avoid circular imports
-        from mply_ingester.ingestion.parsers import ClientDataParser
-        for cls in ClientDataParser.__subclasses__():
-            if cls.id is not None and cls.id == parser_id:
-                return cls(self)
-        raise ValueError(f"No parser found for id: {parser_id}")
+        """Return the shared instance of a parser"""
+        try:
+            return self._parsers[parser_id]
+        except KeyError:
+            pass
+        try:
+            cls = self._registry('parser')[parser_id]
+        except KeyError:
+            raise ValueError(f"No parser found for id: {parser_id}") from None
+        parser = self._parsers[parser_id] = cls(self)
+        return parser
+
+    def get_writer(self, writer_id: str, db: Session, client):
+        """Return a new writer, writers hold the session and client they write for"""
+        try:
+            cls = self._registry('writer')[writer_id]
+        except KeyError:
+            raise ValueError(f"No writer found for id: {writer_id}") from None
+        return cls(self, db, client)
+
 
+def _subclasses_declaring_id(base: type) -> Iterator[type]:
+    """Every subclass of base, at any depth, that declares its own id. Subclasses inheriting an id are skipped."""
+    for cls in base.__subclasses__():
+        if cls.__dict__.get('id') is not None:
+            yield cls
+        yield from _subclasses_declaring_id(cls)
@@ -0,0 +1,19 @@
+CREATE TABLE ingestion_jobs (
+    id SERIAL PRIMARY KEY NOT NULL,
+    client_id INTEGER NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    parser_config JSONB NOT NULL,
+    full_update BOOLEAN NOT NULL DEFAULT false,
+    file_path VARCHAR(1024) NOT NULL,
+    rows_parsed INTEGER NOT NULL DEFAULT 0,
+    rows_written INTEGER NOT NULL DEFAULT 0,
+    error_count INTEGER NOT NULL DEFAULT 0,
+    report JSONB,
+    created_on TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (CURRENT_TIMESTAMP),
+    started_on TIMESTAMP WITHOUT TIME ZONE,
+    finished_on TIMESTAMP WITHOUT TIME ZONE,
+    FOREIGN KEY (client_id) REFERENCES clients(id)
+);
+
+CREATE INDEX ingestion_jobs_client_id_idx ON ingestion_jobs (client_id);
+CREATE INDEX ingestion_jobs_queued_idx ON ingestion_jobs (id) WHERE status = 'queued';
@@ -0,0 +1,15 @@
+-- Keep only the most recently changed product of every (client_id, sku) so the unique index can be created
+DELETE FROM client_products
+WHERE id IN (
+    SELECT id FROM (
+        SELECT id, row_number() OVER (
+            PARTITION BY client_id, sku ORDER BY last_changed_on DESC NULLS LAST, id DESC
+        ) AS position
+        FROM client_products
+        WHERE sku <> ''
+    ) ranked
+    WHERE position > 1
+);
+
+-- Products without a SKU can't be told apart, so they are left out of the unique index
+CREATE UNIQUE INDEX client_products_client_id_sku_key ON client_products (client_id, sku) WHERE sku <> '';
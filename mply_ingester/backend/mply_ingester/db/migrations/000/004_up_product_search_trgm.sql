@@ -0,0 +1,14 @@
+-- Trigram indexes let the ILIKE '%q%' searches of /products/list use an index. pg_trgm ships with the
+-- PostgreSQL contrib modules, servers without them keep working with unindexed searches.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX client_products_sku_trgm_idx ON client_products USING gin (sku gin_trgm_ops);
+        CREATE INDEX client_products_title_trgm_idx ON client_products USING gin (title gin_trgm_ops);
+        CREATE INDEX client_products_remote_id_trgm_idx ON client_products USING gin (remote_id gin_trgm_ops);
+    ELSE
+        RAISE NOTICE 'pg_trgm is not available, product searches will not be indexed';
+    END IF;
+END
+$$;
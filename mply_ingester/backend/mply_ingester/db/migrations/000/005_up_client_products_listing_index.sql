@@ -0,0 +1,3 @@
+-- Serves the queries over all of a client's products: the product list, which pages by (sku, id) keyset, and
+-- deactivating absent SKUs
+CREATE INDEX client_products_client_id_sku_id_idx ON client_products (client_id, sku, id);
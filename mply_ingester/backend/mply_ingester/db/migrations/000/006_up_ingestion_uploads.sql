@@ -0,0 +1,17 @@
+CREATE TABLE ingestion_uploads (
+    id SERIAL PRIMARY KEY NOT NULL,
+    client_id INTEGER NOT NULL,
+    upload_hash CHAR(64) NOT NULL,
+    idempotency_key VARCHAR(255),
+    report JSONB NOT NULL,
+    created_on TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (CURRENT_TIMESTAMP),
+    FOREIGN KEY (client_id) REFERENCES clients(id)
+);
+
+CREATE INDEX ingestion_uploads_client_id_id_idx ON ingestion_uploads (client_id, id);
+CREATE UNIQUE INDEX ingestion_uploads_client_id_idempotency_key_key ON ingestion_uploads (client_id, idempotency_key)
+    WHERE idempotency_key IS NOT NULL;
+
+ALTER TABLE ingestion_jobs
+    ADD COLUMN upload_hash CHAR(64),
+    ADD COLUMN idempotency_key VARCHAR(255);
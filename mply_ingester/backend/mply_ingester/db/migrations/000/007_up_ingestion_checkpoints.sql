@@ -0,0 +1,11 @@
+CREATE TABLE ingestion_checkpoints (
+    id SERIAL PRIMARY KEY NOT NULL,
+    client_id INTEGER NOT NULL,
+    upload_hash CHAR(64) NOT NULL,
+    rows_committed INTEGER NOT NULL DEFAULT 0,
+    last_existing_id INTEGER,
+    updated_on TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (CURRENT_TIMESTAMP),
+    FOREIGN KEY (client_id) REFERENCES clients(id)
+);
+
+CREATE UNIQUE INDEX ingestion_checkpoints_client_id_upload_hash_key ON ingestion_checkpoints (client_id, upload_hash);
@@ -0,0 +1,2 @@
+-- Every authenticated request without a cached session looks the user up by the token of its cookie
+CREATE INDEX users_session_token_idx ON users (session_token) WHERE session_token IS NOT NULL;
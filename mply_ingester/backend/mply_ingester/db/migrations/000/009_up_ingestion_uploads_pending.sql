@@ -0,0 +1,2 @@
+-- An ingest sent with an idempotency key reserves it with a row without report until it has finished
+ALTER TABLE ingestion_uploads ALTER COLUMN report DROP NOT NULL;
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Numeric, TIMESTAMP, func
+from sqlalchemy import Column, Index, Integer, String, Boolean, DateTime, ForeignKey, Numeric, TIMESTAMP, func, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -30,6 +31,10 @@ class User(Base):
 
     client = relationship('Client', back_populates='users')
 
+    __table_args__ = (
+        Index('users_session_token_idx', 'session_token', postgresql_where=text("session_token IS NOT NULL")),
+    )
+
 
 class ClientProduct(Base):
     __tablename__ = 'client_products'
@@ -48,3 +53,69 @@ class ClientProduct(Base):
     reference_price = Column(Numeric(12, 2))
 
     client = relationship('Client')
+
+    __table_args__ = (
+        Index('client_products_client_id_sku_key', 'client_id', 'sku', unique=True,
+              postgresql_where=text("sku <> ''")),
+        Index('client_products_client_id_sku_id_idx', 'client_id', 'sku', 'id'),
+    )
+
+
+class IngestionJob(Base):
+    __tablename__ = 'ingestion_jobs'
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
+    status = Column(String(20), nullable=False, server_default=QUEUED)
+    parser_config = Column(JSONB, nullable=False)
+    full_update = Column(Boolean, nullable=False, server_default='0')
+    file_path = Column(String(1024), nullable=False)
+    upload_hash = Column(String(64))
+    idempotency_key = Column(String(255))
+    rows_parsed = Column(Integer, nullable=False, server_default='0')
+    rows_written = Column(Integer, nullable=False, server_default='0')
+    error_count = Column(Integer, nullable=False, server_default='0')
+    report = Column(JSONB)
+    created_on = Column(DateTime, nullable=False, server_default=func.current_timestamp())
+    started_on = Column(DateTime)
+    finished_on = Column(DateTime)
+
+    client = relationship('Client')
+
+
+class IngestionUpload(Base):
+    __tablename__ = 'ingestion_uploads'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
+    upload_hash = Column(String(64), nullable=False)
+    idempotency_key = Column(String(255))
+    # None while the ingest that reserved the idempotency key is running
+    report = Column(JSONB)
+    created_on = Column(DateTime, nullable=False, server_default=func.current_timestamp())
+
+    __table_args__ = (
+        Index('ingestion_uploads_client_id_id_idx', 'client_id', 'id'),
+        Index('ingestion_uploads_client_id_idempotency_key_key', 'client_id', 'idempotency_key', unique=True,
+              postgresql_where=text("idempotency_key IS NOT NULL")),
+    )
+
+
+class IngestionCheckpoint(Base):
+    __tablename__ = 'ingestion_checkpoints'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
+    upload_hash = Column(String(64), nullable=False)
+    rows_committed = Column(Integer, nullable=False, server_default='0')
+    last_existing_id = Column(Integer)
+    updated_on = Column(DateTime, nullable=False, server_default=func.current_timestamp())
+
+    __table_args__ = (
+        Index('ingestion_checkpoints_client_id_upload_hash_key', 'client_id', 'upload_hash', unique=True),
+    )
@@ -6,3 +6,28 @@ DB_PASSWORD = '123'
 DB_HOST = 'localhost'
 
 DATABASE_URI = f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+
+# Ingestion
+INGEST_WRITER = 'bulk'  # 'bulk' resolves the SKUs of a whole batch at once, 'row' looks up every row on its own
+INGEST_BATCH_SIZE = 1000
+INGEST_COPY_THRESHOLD = 50000  # Files with at least this many rows are COPYed into a staging table, None disables
+INGEST_MAX_UPLOAD_SIZE = 5 * 1024 ** 3  # In bytes, enforced while the upload is streamed through the parser
+INGEST_MAX_DECOMPRESSED_SIZE = 50 * 1024 ** 3  # In bytes, for gzip, bz2, xz and zip uploads once decompressed
+INGEST_PIPELINE_DEPTH = 4  # Chunks parsed ahead of the database writes in a background thread, 0 parses in turn
+INGEST_ERROR_BUDGET = 0  # Rows with unconvertible values skipped before the file is rejected, a count or e.g. '2%'
+INGEST_MAX_REPORTED_ERRORS = 1000  # Rejected values listed in the ingest report, all of them are counted
+INGEST_COMMIT_EVERY = None  # Rows per transaction, committed with a checkpoint to resume from. None: one per file
+INGEST_DEDUP_MAX_AGE = 24 * 3600  # Seconds a successful ingest is remembered for repeated uploads and idempotency keys
+INGEST_DRY_RUN_SAMPLE_SIZE = 20  # Products of each kind of change listed by a dry run ingest
+
+# Web
+WEB_THREADPOOL_SIZE = 40  # Threads for blocking endpoints and dependencies
+INGEST_MAX_CONCURRENCY = 2  # Ingests running at the same time per worker process, further ones wait for a slot
+EXPORT_BATCH_SIZE = 1000  # Products fetched from the server side cursor at a time by /products/export
+AUTH_CACHE_SIZE = 10000  # Session tokens whose user and client are kept in memory per worker process, 0 disables
+AUTH_CACHE_TTL = 60  # Seconds a cached session token is trusted, how late other processes see a logout or deactivation
+
+# Background ingestion jobs
+INGEST_JOB_WORKERS = 2
+INGEST_JOB_STORAGE_DIR = None  # Where uploads wait for their job to run, None for the system temp dir
+INGEST_JOB_PROGRESS_INTERVAL = 1.0  # Minimum seconds between progress updates of a running job
@@ -1,25 +1,55 @@
 from abc import ABC, abstractmethod
 import csv
-from typing import Dict, Tuple, List, io, Any
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple, List, Union, io, Any
 
 from mply_ingester.config import ConfigBroker
-from pydantic import BaseModel, Field
-from pydantic.dataclasses import dataclass
-import zipfile
+from pydantic import BaseModel, Field, field_validator
 
 
 from mply_ingester.db.models import ClientProduct
+from mply_ingester.ingestion.transformers import TRANSFORM_ERRORS, BaseTransformer
 
-ALL_MULTIPLY_COLUMN_NAMES = [
+ALL_MULTIPLY_COLUMN_NAMES = frozenset(
     column.name
     for column in ClientProduct.__table__.columns
     if column.name != "id"
-]
+)
+
+# An interpreted row: multiply column name to value
+Record = Dict[str, Any]
+
+def parse_error_budget(error_budget: Union[int, str]) -> Tuple[Optional[int], Optional[float]]:
+    """
+    Split an error budget into a row count and a percentage of the rows, one of which is None.
+
+    Raises:
+        ValueError: If the budget is neither a count nor a percentage like '2.5%'
+    """
+    if isinstance(error_budget, str) and error_budget.strip().endswith('%'):
+        percent = float(error_budget.strip()[:-1])
+        if not 0 <= percent <= 100:
+            raise ValueError(f"Error budget percentage out of range: {error_budget}")
+        return None, percent
+    count = int(error_budget)
+    if count < 0:
+        raise ValueError(f"Negative error budget: {error_budget}")
+    return count, None
+
 
 class ParserConfig(BaseModel):
     parser_id: str
     column_mapping: Dict[str, Tuple[str, str]] = Field(default_factory=dict,
                                                        description="A mapping of client column names to (multiply column names and transformers")
+    error_budget: Optional[Union[int, str]] = Field(None,
+                                                    description="Rows that may be rejected for values that cannot be converted before the whole file is, a count or a percentage like '2%'. Defaults to INGEST_ERROR_BUDGET")
+
+    @field_validator('error_budget')
+    @classmethod
+    def check_error_budget(cls, error_budget):
+        if error_budget is not None:
+            parse_error_budget(error_budget)
+        return error_budget
 
 
 class IngestionReport(BaseModel):
@@ -29,7 +59,104 @@ class IngestionReport(BaseModel):
     report: List[Any]
     stats: Dict[str, Any]
 
-@dataclass
+
+class IngestionProgress:
+    """Counts the rows parsed and written while an ingest runs and reports them to an optional callback"""
+
+    def __init__(self, callback: Optional[Callable[[int, int], None]] = None):
+        self.rows_parsed = 0
+        self.rows_written = 0
+        self.callback = callback
+
+    def add_parsed(self, count: int) -> None:
+        self.rows_parsed += count
+        self._report()
+
+    def add_written(self, count: int) -> None:
+        self.rows_written += count
+        self._report()
+
+    def _report(self) -> None:
+        if self.callback is not None:
+            self.callback(self.rows_parsed, self.rows_written)
+
+
+class ErrorBudgetExceededError(ValueError):
+    pass
+
+
+class RejectedRows:
+    """
+    Collects the rows rejected during an ingest for the report, up to max_reported errors, and fails the ingest
+    once they go over the error budget. A count is checked as the rows come, a percentage once all have been seen.
+    """
+
+    def __init__(self, error_budget: Union[int, str], max_reported: int):
+        self.error_budget = error_budget
+        self.max_count, self.max_percent = parse_error_budget(error_budget)
+        self.max_reported = max_reported
+        self.count = 0
+        self.reported: List[Dict[str, Any]] = []
+        # Kept apart from reported, which may be limited to none
+        self.first_error: Optional[str] = None
+
+    def add(self, row_number: int, row: 'RejectedRow') -> None:
+        """
+        Raises:
+            ErrorBudgetExceededError: If the error budget is a count and this row goes over it
+        """
+        self.count += 1
+        if self.first_error is None:
+            error = row.errors[0]
+            self.first_error = f"row {row_number}, column {error.column_name!r}: {error.reason}"
+        for error in row.errors:
+            if len(self.reported) < self.max_reported:
+                self.reported.append({'row': row_number, 'column': error.column_name,
+                                      'value': str(error.value), 'reason': error.reason})
+        if self.max_count is not None and self.count > self.max_count:
+            raise ErrorBudgetExceededError(self._describe())
+
+    def check_total(self, row_count: int) -> None:
+        """
+        Raises:
+            ErrorBudgetExceededError: If the error budget is a percentage and more of the rows were rejected
+        """
+        if self.max_percent is not None and self.count > row_count * self.max_percent / 100:
+            raise ErrorBudgetExceededError(self._describe())
+
+    def _describe(self) -> str:
+        if self.max_count == 0:
+            return self.first_error[0].upper() + self.first_error[1:]
+        return f"{self.count} rows rejected, over the error budget of {self.error_budget}. First at {self.first_error}"
+
+@dataclass(slots=True)
+class CellError:
+    column_name: str
+    value: Any
+    reason: str
+
+
+@dataclass(slots=True)
+class RejectedRow:
+    """Stands in for the record of a row with values that its transformers could not convert"""
+    errors: List[CellError]
+
+
+def _interpret_cells(cells: Iterable[Tuple[str, str, Callable[[Any], Any], Any]]) -> Union[Record, RejectedRow]:
+    """Interpret (client column name, target, transform, value) cells one by one, rejecting the row on any error"""
+    record, errors = {}, []
+    for column_name, target, transform, value in cells:
+        try:
+            record[target] = transform(value)
+        except TRANSFORM_ERRORS as e:
+            errors.append(CellError(column_name, value, str(e)))
+    return RejectedRow(errors) if errors else record
+
+
+# Parsed rows are plain slotted dataclasses: they are created for every cell, so they skip pydantic validation.
+# Pydantic models are only used for what goes in and out of the API.
+
+@dataclass(slots=True)
 class ParsedElement:
     column_name: str
     value: Any
@@ -48,7 +175,7 @@ class ParsedElement:
             is_interpreted=True
         )
 
-@dataclass
+@dataclass(slots=True)
 class ParsedItem:
     elements: List[ParsedElement]
 
@@ -72,3 +199,141 @@ class ParsedItem:
         return all(element.is_interpreted for element in self.elements)
 
 
+
+
+_MISSING = object()
+
+
+def _resolve_path(document: Any, path: Tuple[str, ...]) -> Any:
+    value = document
+    for key in path:
+        if isinstance(value, dict):
+            value = value.get(key, _MISSING)
+        elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+class ColumnMappingPlan:
+    """
+    A column mapping compiled once per ingest: the multiply columns and transformers are checked up front and
+    every client column is bound to its target column and transformer, so rows can be interpreted without any
+    per-cell lookups or checks.
+    """
+
+    def __init__(self, steps: Dict[str, Tuple[str, BaseTransformer]]):
+        # client column name -> (multiply column name, transformer)
+        self.steps = steps
+
+    @classmethod
+    def compile(cls, config_broker: ConfigBroker, column_mapping: Dict[str, Tuple[str, str]]) -> 'ColumnMappingPlan':
+        """
+        Raises:
+            ValueError: If a multiply column or transformer in the mapping does not exist
+        """
+        steps = {}
+        for client_column_name, (multiply_column_name, transformer_name) in column_mapping.items():
+            if multiply_column_name not in ALL_MULTIPLY_COLUMN_NAMES:
+                raise ValueError(f"Unknown multiply column for {client_column_name!r}: {multiply_column_name}")
+            steps[client_column_name] = (multiply_column_name, config_broker.get_transformer(transformer_name))
+        return cls(steps)
+
+    def _positional_steps(self, header: Sequence[str]) -> List[Tuple[int, str, str, BaseTransformer]]:
+        # Like csv.DictReader the last of duplicate columns wins
+        positions = {column_name: position for position, column_name in enumerate(header) if column_name}
+        return sorted(
+            (position, column_name, *self.steps[column_name])
+            for column_name, position in positions.items()
+            if column_name in self.steps
+        )
+
+    def bind(self, header: Sequence[str]) -> Callable[[Sequence[Any]], Union[Record, RejectedRow]]:
+        """
+        Bind the plan to the positions of the client columns in a header, returning a function that interprets
+        a row of values in that order. Values missing from the end of a short row are skipped. A row with values
+        that cannot be converted comes out as a RejectedRow.
+        """
+        steps = tuple((position, column_name, target, transformer.transform)
+                      for position, column_name, target, transformer in self._positional_steps(header))
+        min_length = steps[-1][0] + 1 if steps else 0
+
+        def interpret_row(row: Sequence[Any]) -> Union[Record, RejectedRow]:
+            try:
+                if len(row) >= min_length:
+                    return {target: transform(row[position]) for position, _, target, transform in steps}
+                return {target: transform(row[position]) for position, _, target, transform in steps
+                        if position < len(row)}
+            except TRANSFORM_ERRORS:
+                return _interpret_cells((column_name, target, transform, row[position])
+                                        for position, column_name, target, transform in steps
+                                        if position < len(row))
+
+        return interpret_row
+
+    def bind_columns(self, header: Sequence[str]) -> Callable[[List[Sequence[Any]]], List[Record]]:
+        """
+        Like bind, but the returned function interprets a chunk of rows column by column with the transformers'
+        transform_many. Chunks with short rows, or with values that cannot be converted, are interpreted row by row.
+        """
+        positional_steps = self._positional_steps(header)
+        targets = tuple(target for _, _, target, _ in positional_steps)
+        steps = tuple((position, transformer.transform_many) for position, _, _, transformer in positional_steps)
+        min_length = positional_steps[-1][0] + 1 if positional_steps else 0
+        interpret_row = self.bind(header)
+
+        def interpret_rows(rows: List[Sequence[Any]]) -> List[Union[Record, RejectedRow]]:
+            if any(len(row) < min_length for row in rows):
+                return [interpret_row(row) for row in rows]
+            if not steps:
+                return [{} for _ in rows]
+            try:
+                columns = [transform_many([row[position] for row in rows]) for position, transform_many in steps]
+            except TRANSFORM_ERRORS:
+                return [interpret_row(row) for row in rows]
+            return [dict(zip(targets, values)) for values in zip(*columns)]
+
+        return interpret_rows
+
+    def bind_paths(self) -> Callable[[Any], Record]:
+        """
+        Bind the plan to nested documents, returning a function that interprets a JSON object. Client column
+        names are dotted paths into the object, e.g. 'price.amount' or 'images.0.url'. A key that contains dots
+        itself is found too. Missing values and nulls are skipped. An object with values that cannot be converted
+        comes out as a RejectedRow.
+        """
+        steps = tuple(
+            (client_column_name, tuple(client_column_name.split('.')), target, transformer.transform)
+            for client_column_name, (target, transformer) in self.steps.items()
+        )
+
+        def interpret_document(document: Any) -> Union[Record, RejectedRow]:
+            cells = []
+            for client_column_name, path, target, transform in steps:
+                value = document.get(client_column_name, _MISSING)
+                if value is _MISSING and len(path) > 1:
+                    value = _resolve_path(document, path)
+                if value is not _MISSING and value is not None:
+                    cells.append((client_column_name, target, transform, value))
+            try:
+                return {target: transform(value) for _, target, transform, value in cells}
+            except TRANSFORM_ERRORS:
+                return _interpret_cells(cells)
+
+        return interpret_document
+
+    def interpret_item(self, item: ParsedItem) -> Union[Record, RejectedRow]:
+        """Interpret a parsed item, for parsers without a fixed column order"""
+        cells = []
+        for element in item.elements:
+            step = self.steps.get(element.column_name)
+            if step is not None:
+                multiply_column_name, transformer = step
+                cells.append((element.column_name, multiply_column_name, transformer.transform, element.value))
+        try:
+            return {target: transform(value) for _, target, transform, value in cells}
+        except TRANSFORM_ERRORS:
+            return _interpret_cells(cells)
@@ -0,0 +1,161 @@
+import hashlib
+import json
+from datetime import timedelta
+from typing import BinaryIO, Optional
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from mply_ingester.config import ConfigBroker
+from mply_ingester.db.models import IngestionUpload
+from mply_ingester.ingestion.base import IngestionReport, ParserConfig
+
+
+class IdempotencyKeyReusedError(ValueError):
+    pass
+
+
+class IdempotencyKeyInProgressError(RuntimeError):
+    pass
+
+
+def hash_upload(upload: BinaryIO, parser_config: ParserConfig, full_update: bool = False,
+                block_size: int = 1024 ** 2) -> str:
+    """
+    SHA-256 of everything that decides the outcome of an ingest: the uploaded bytes, the parser config and the
+    update mode. Reads the upload to the end and rewinds it, so it must be seekable.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(
+        [parser_config.model_dump(mode='json'), full_update], sort_keys=True
+    ).encode('utf-8'))
+    while block := upload.read(block_size):
+        digest.update(block)
+    upload.seek(0)
+    return digest.hexdigest()
+
+
+def reserve_idempotency_key(config_broker: ConfigBroker, db: Session, client_id: int, upload_hash: str,
+                            idempotency_key: str) -> Optional[IngestionReport]:
+    """
+    Reserve the idempotency key for an ingest that is about to start, so that a retry sent while it runs is not
+    ingested a second time. Returns the report of the earlier ingest sent with the key if it has finished, in which
+    case nothing is reserved. A reservation ends with record_ingest once the ingest succeeds, or with
+    release_idempotency_key otherwise. Commits.
+
+    Raises:
+        IdempotencyKeyReusedError: If the idempotency key was sent before with a different upload
+        IdempotencyKeyInProgressError: If the ingest sent with the idempotency key has not finished yet
+    """
+    _forget_old_ingests(config_broker, db, client_id)
+    while True:
+        reserved = db.execute(insert(IngestionUpload).values(
+            client_id=client_id,
+            upload_hash=upload_hash,
+            idempotency_key=idempotency_key,
+        ).on_conflict_do_nothing(
+            index_elements=['client_id', 'idempotency_key'],
+            index_where=IngestionUpload.idempotency_key.isnot(None)
+        ).returning(IngestionUpload.id)).first()
+        db.commit()
+        if reserved is not None:
+            return None
+        previous = db.scalars(select(IngestionUpload).where(
+            IngestionUpload.client_id == client_id,
+            IngestionUpload.idempotency_key == idempotency_key
+        )).first()
+        # Otherwise the ingest that held the key failed in the meantime, and the key is free again
+        if previous is not None:
+            break
+    if previous.upload_hash != upload_hash:
+        raise IdempotencyKeyReusedError("Idempotency-Key was already used for a different upload")
+    if previous.report is None:
+        raise IdempotencyKeyInProgressError("The ingest sent with this Idempotency-Key has not finished yet")
+    return IngestionReport.model_validate(previous.report)
+
+
+def release_idempotency_key(db: Session, client_id: int, idempotency_key: str) -> None:
+    """Free the idempotency key reserved for an ingest that failed, so that it can be retried. Commits."""
+    db.execute(delete(IngestionUpload).where(
+        IngestionUpload.client_id == client_id,
+        IngestionUpload.idempotency_key == idempotency_key,
+        IngestionUpload.report.is_(None)
+    ))
+    db.commit()
+
+
+def find_previous_ingest(config_broker: ConfigBroker, db: Session, client_id: int,
+                         upload_hash: str) -> Optional[IngestionReport]:
+    """
+    Return the report of the client's latest finished ingest if it was of the same upload, as the upload is then
+    redundant. An upload that matches an older ingest is ingested again, as the ingests since may have changed the
+    products. Only ingests of the last INGEST_DEDUP_MAX_AGE seconds count. Changes made to the products by other
+    means than an ingest go unnoticed.
+    """
+    latest = db.scalars(select(IngestionUpload).where(
+        IngestionUpload.client_id == client_id,
+        IngestionUpload.report.isnot(None),
+        IngestionUpload.created_on >= _oldest_remembered(config_broker)
+    ).order_by(IngestionUpload.id.desc()).limit(1)).first()
+    if latest is not None and latest.upload_hash == upload_hash:
+        return IngestionReport.model_validate(latest.report)
+    return None
+
+
+def record_ingest(config_broker: ConfigBroker, db: Session, client_id: int, upload_hash: str,
+                  idempotency_key: Optional[str], report: IngestionReport) -> None:
+    """
+    Remember a successful ingest, in the row reserved for its idempotency key if it has one, and forget the
+    client's ingests that are too old to be looked up. Commits.
+    """
+    _forget_old_ingests(config_broker, db, client_id)
+    if idempotency_key is not None:
+        recorded = db.execute(update(IngestionUpload).where(
+            IngestionUpload.client_id == client_id,
+            IngestionUpload.idempotency_key == idempotency_key
+        ).values(
+            upload_hash=upload_hash,
+            report=report.model_dump(mode='json'),
+            created_on=func.current_timestamp()
+        ))
+        if recorded.rowcount:
+            db.commit()
+            return
+    # The reservation is gone if it was older than INGEST_DEDUP_MAX_AGE, a concurrent retry may then have got there
+    # first, its report stands
+    db.execute(insert(IngestionUpload).values(
+        client_id=client_id,
+        upload_hash=upload_hash,
+        idempotency_key=idempotency_key,
+        report=report.model_dump(mode='json'),
+    ).on_conflict_do_nothing(
+        index_elements=['client_id', 'idempotency_key'],
+        index_where=IngestionUpload.idempotency_key.isnot(None)
+    ))
+    db.commit()
+
+
+def forget_ingests(db: Session, client_id: int) -> None:
+    """
+    Forget every ingest of the client, once an ingest that failed has committed some of its rows. The products
+    then no longer match the report of any earlier ingest, and an upload sent again must be ingested. Commits.
+    The keys reserved for ingests that have not finished stay reserved.
+    """
+    db.execute(delete(IngestionUpload).where(
+        IngestionUpload.client_id == client_id,
+        IngestionUpload.report.isnot(None)
+    ))
+    db.commit()
+
+
+def _forget_old_ingests(config_broker: ConfigBroker, db: Session, client_id: int) -> None:
+    db.execute(delete(IngestionUpload).where(
+        IngestionUpload.client_id == client_id,
+        IngestionUpload.created_on < _oldest_remembered(config_broker)
+    ))
+
+
+def _oldest_remembered(config_broker: ConfigBroker):
+    # Computed by the database, which also sets created_on
+    return func.current_timestamp() - timedelta(seconds=config_broker['INGEST_DEDUP_MAX_AGE'])
@@ -0,0 +1,195 @@
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from mply_ingester.config import ConfigBroker
+from mply_ingester.db.models import Client, IngestionJob
+from mply_ingester.ingestion.base import IngestionReport, ParserConfig
+from mply_ingester.ingestion.dedup import record_ingest, release_idempotency_key
+from mply_ingester.ingestion.service import DataIngestionService
+from mply_ingester.ingestion.streams import limit_size
+
+logger = logging.getLogger(__name__)
+
+# First key of the advisory locks of running jobs, the second is the job id
+JOB_LOCK_CLASS = 7301
+
+
+class IngestionJobRunner:
+    """
+    Runs ingests in the background on a local pool of INGEST_JOB_WORKERS threads. The jobs and their progress live
+    in the ingestion_jobs table, the uploads wait in INGEST_JOB_STORAGE_DIR until their job has run.
+    """
+
+    def __init__(self, config_broker: ConfigBroker):
+        self.config_broker = config_broker
+        self.storage_dir = config_broker['INGEST_JOB_STORAGE_DIR'] or tempfile.gettempdir()
+        self._pool = ThreadPoolExecutor(max_workers=config_broker['INGEST_JOB_WORKERS'],
+                                        thread_name_prefix='ingest-job')
+
+    def enqueue(self, db: Session, client: Client, parser_config: ParserConfig, upload: BinaryIO,
+                full_update: bool = False, upload_hash: Optional[str] = None,
+                idempotency_key: Optional[str] = None) -> IngestionJob:
+        """
+        Store the upload and queue a job to ingest it. If the upload_hash is given, the ingest is recorded for
+        deduplication once it succeeds. The job takes over the idempotency key reserved for it, and releases it if
+        the ingest fails.
+
+        Raises:
+            UploadTooLargeError: If the upload is bigger than INGEST_MAX_UPLOAD_SIZE
+        """
+        os.makedirs(self.storage_dir, exist_ok=True)
+        fd, file_path = tempfile.mkstemp(prefix=f'ingest-{client.id}-', dir=self.storage_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(limit_size(upload, self.config_broker['INGEST_MAX_UPLOAD_SIZE']), f)
+        except Exception:
+            os.remove(file_path)
+            raise
+
+        job = IngestionJob(
+            client_id=client.id,
+            status=IngestionJob.QUEUED,
+            parser_config=parser_config.model_dump(mode='json'),
+            full_update=full_update,
+            file_path=file_path,
+            upload_hash=upload_hash,
+            idempotency_key=idempotency_key,
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        self._pool.submit(self._run, job.id)
+        return job
+
+    def resume_queued(self) -> None:
+        """
+        Submit the jobs that were queued but never started, e.g. because the process was restarted, along with the
+        jobs left running by a worker that is gone. The latter start over, a chunked ingest resumes from its
+        checkpoint.
+        """
+        db = self.config_broker.get_session()
+        try:
+            stale_ids = db.scalars(
+                select(IngestionJob.id).where(IngestionJob.status == IngestionJob.RUNNING).order_by(IngestionJob.id)
+            ).all()
+            for job_id in stale_ids:
+                with self._locked(job_id) as locked:
+                    if locked:
+                        db.query(IngestionJob).filter(
+                            IngestionJob.id == job_id,
+                            IngestionJob.status == IngestionJob.RUNNING
+                        ).update({'status': IngestionJob.QUEUED, 'started_on': None})
+                        db.commit()
+            job_ids = db.scalars(
+                select(IngestionJob.id).where(IngestionJob.status == IngestionJob.QUEUED).order_by(IngestionJob.id)
+            ).all()
+        finally:
+            db.close()
+        for job_id in job_ids:
+            self._pool.submit(self._run, job_id)
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True)
+
+    @contextmanager
+    def _locked(self, job_id: int) -> Iterator[bool]:
+        """
+        Hold the advisory lock of the job if no other worker does, yields whether it does. PostgreSQL also releases
+        the lock when the worker's process dies, so a running job whose lock is free was left behind.
+        """
+        db = self.config_broker.get_session()
+        try:
+            with db.get_bind().connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                locked = connection.scalar(select(func.pg_try_advisory_lock(JOB_LOCK_CLASS, job_id)))
+                try:
+                    yield locked
+                finally:
+                    # The connection goes back to the pool, which would keep the lock
+                    if locked:
+                        connection.scalar(select(func.pg_advisory_unlock(JOB_LOCK_CLASS, job_id)))
+        finally:
+            db.close()
+
+    def _claim(self, db: Session, job_id: int) -> bool:
+        # Only one worker may move a job out of the queue, even across processes
+        claimed = db.query(IngestionJob).filter(
+            IngestionJob.id == job_id,
+            IngestionJob.status == IngestionJob.QUEUED
+        ).update({'status': IngestionJob.RUNNING, 'started_on': func.current_timestamp()})
+        db.commit()
+        return claimed == 1
+
+    def _run(self, job_id: int) -> None:
+        # Held until the job has finished, so that resume_queued does not take it for one left behind
+        with self._locked(job_id) as locked:
+            if locked:
+                self._ingest(job_id)
+
+    def _ingest(self, job_id: int) -> None:
+        db = self.config_broker.get_session()
+        progress_db = self.config_broker.get_session()
+        file_path = None
+        try:
+            if not self._claim(db, job_id):
+                return
+            job = db.get(IngestionJob, job_id)
+            file_path = job.file_path
+            client = db.get(Client, job.client_id)
+
+            # Progress goes through its own session, the ingest session must only commit once the ingest is done
+            progress_interval = self.config_broker['INGEST_JOB_PROGRESS_INTERVAL']
+            last_update = 0.0
+
+            def on_progress(rows_parsed: int, rows_written: int) -> None:
+                nonlocal last_update
+                if time.monotonic() - last_update < progress_interval:
+                    return
+                last_update = time.monotonic()
+                progress_db.query(IngestionJob).filter(IngestionJob.id == job_id).update(
+                    {'rows_parsed': rows_parsed, 'rows_written': rows_written}
+                )
+                progress_db.commit()
+
+            try:
+                with open(file_path, 'rb') as f:
+                    report = DataIngestionService(self.config_broker, db, client).ingest_data(
+                        ParserConfig.model_validate(job.parser_config), f,
+                        full_update=job.full_update, progress_callback=on_progress, upload_hash=job.upload_hash
+                    )
+            except Exception as e:
+                logger.exception('Ingestion job %s failed', job_id)
+                db.rollback()
+                report = IngestionReport(success=False, message=f"Error processing data: {e}",
+                                         processed_items=0, report=[], stats={})
+
+            self._finish(db, job_id, report)
+        finally:
+            # Also if the job could not be finished, its upload would otherwise stay behind
+            if file_path is not None and os.path.exists(file_path):
+                os.remove(file_path)
+            progress_db.close()
+            db.close()
+
+    def _finish(self, db: Session, job_id: int, report: IngestionReport) -> None:
+        job = db.get(IngestionJob, job_id)
+        job.status = IngestionJob.SUCCEEDED if report.success else IngestionJob.FAILED
+        job.report = report.model_dump(mode='json')
+        job.rows_written = report.processed_items
+        job.rows_parsed = max(job.rows_parsed, report.processed_items)
+        # A file rejected for its rows fails for those rows, not for one more error
+        job.error_count = report.stats.get('rejected_count', 0) or (0 if report.success else 1)
+        job.finished_on = func.current_timestamp()
+        db.commit()
+        if report.success and job.upload_hash is not None:
+            record_ingest(self.config_broker, db, job.client_id, job.upload_hash, job.idempotency_key, report)
+        elif not report.success and job.idempotency_key is not None:
+            release_idempotency_key(db, job.client_id, job.idempotency_key)
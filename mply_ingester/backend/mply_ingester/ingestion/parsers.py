@@ -1,48 +1,227 @@
 from abc import ABC, abstractmethod
 import csv
 import io
-from typing import List, Dict, Tuple
+import json
+from itertools import islice
+import re
+from typing import Any, BinaryIO, Dict, Iterator, List, TextIO, Tuple
 
 from mply_ingester.config import ConfigBroker
-from mply_ingester.ingestion.base import ParsedItem, ParsedElement
+from mply_ingester.ingestion.base import ColumnMappingPlan, ParsedItem, ParsedElement, Record
 
 
 class ClientDataParser(ABC):
-    """Parse and interpret client data"""
+    """Parse and interpret client data. ConfigBroker shares one instance per id, so parsers must be stateless."""
 
     id = None
 
     def __init__(self, config_broker: ConfigBroker):
         self.config_broker = config_broker
 
-    def process_client_data(self, client_data: bytes, column_mapping: Dict[str, Tuple[str, str]]) -> List[ParsedItem]:
-        parsed_items = self.parse_client_data(client_data)
+    def process_client_data(self, client_data: BinaryIO,
+                            column_mapping: Dict[str, Tuple[str, str]]) -> Iterator[List[Record]]:
+        """
+        Parse and interpret the client data as a stream, yielding lists of at most INGEST_BATCH_SIZE
+        records so memory use does not depend on the size of the file. A row with values that cannot be
+        converted comes out as a RejectedRow in place of its record.
 
-        for item in parsed_items:
-            item.interpret(self.config_broker, column_mapping)
+        Raises:
+            ValueError: If the column mapping refers to an unknown multiply column or transformer
+        """
+        plan = ColumnMappingPlan.compile(self.config_broker, column_mapping)
+        return self.interpret_client_data(client_data, plan, self.config_broker['INGEST_BATCH_SIZE'])
 
-        return parsed_items
+    def interpret_client_data(self, client_data: BinaryIO, plan: ColumnMappingPlan,
+                              chunk_size: int) -> Iterator[List[Record]]:
+        """
+        Lazily parse and interpret lists of at most chunk_size records. Parsers that know the position of every
+        column should override this and interpret each chunk column by column with the plan bound to those
+        positions, instead of going through parsed items.
+        """
+        parsed_items = self.parse_client_data(client_data)
+        while chunk := list(islice(parsed_items, chunk_size)):
+            yield [plan.interpret_item(item) for item in chunk]
 
     @abstractmethod
-    def parse_client_data(self, client_data: bytes) -> List[ParsedItem]:
+    def parse_client_data(self, client_data: BinaryIO) -> Iterator[ParsedItem]:
+        """Lazily parse items from a binary file-like object"""
         pass
 
 class CSVParser(ClientDataParser):
 
     id = 'csv'
 
-    def parse_client_data(self, client_data: bytes) -> List[ParsedItem]:
-        content = client_data.decode('utf-8')
-        csv_reader = csv.DictReader(io.StringIO(content))
+    def parse_client_data(self, client_data: BinaryIO) -> Iterator[ParsedItem]:
+        # TextIOWrapper decodes incrementally as the csv reader pulls lines
+        text_stream = io.TextIOWrapper(client_data, encoding='utf-8', newline='')
+        try:
+            csv_reader = csv.reader(text_stream)
+            header = [column_name.strip() for column_name in next(csv_reader, [])]
+            # Like csv.DictReader: the last of duplicate columns wins, missing values of short rows are left out
+            columns = list({column_name: position for position, column_name in enumerate(header) if column_name}.items())
+            for row in csv_reader:
+                elements = [ParsedElement(column_name, row[position]) for column_name, position in columns
+                            if position < len(row)]
+                if elements:
+                    yield ParsedItem(elements)
+        finally:
+            # Don't let the wrapper close the caller's file object
+            text_stream.detach()
+
+    def interpret_client_data(self, client_data: BinaryIO, plan: ColumnMappingPlan,
+                              chunk_size: int) -> Iterator[List[Record]]:
+        text_stream = io.TextIOWrapper(client_data, encoding='utf-8', newline='')
+        try:
+            csv_reader = csv.reader(text_stream)
+            header = next(csv_reader, None)
+            if header is None:
+                return
+            interpret_rows = plan.bind_columns([column_name.strip() for column_name in header])
+            # Blank lines are skipped, like csv.DictReader does
+            rows = filter(None, csv_reader)
+            while chunk := list(islice(rows, chunk_size)):
+                yield interpret_rows(chunk)
+        finally:
+            text_stream.detach()
+
+
+class JSONDocumentParser(ClientDataParser):
+    """
+    Base for parsers of a stream of JSON objects, one item per object. Client column names are dotted paths
+    into the objects, e.g. 'price.amount' or 'images.0.url'.
+    """
+
+    @abstractmethod
+    def iter_documents(self, text_stream: TextIO) -> Iterator[Any]:
+        """Lazily read the JSON values from the text stream"""
+        pass
 
-        parsed_items = []
-        for row in csv_reader:
-            elements = []
-            for column_name, value in row.items():
-                if column_name and value is not None:
-                    elements.append(ParsedElement(column_name=column_name.strip(), value=value))
+    def _documents(self, client_data: BinaryIO) -> Iterator[Dict[str, Any]]:
+        text_stream = io.TextIOWrapper(client_data, encoding='utf-8')
+        try:
+            for document in self.iter_documents(text_stream):
+                if not isinstance(document, dict):
+                    raise ValueError(f"Expected a JSON object, got {type(document).__name__}")
+                yield document
+        finally:
+            # Don't let the wrapper close the caller's file object
+            text_stream.detach()
 
+    def parse_client_data(self, client_data: BinaryIO) -> Iterator[ParsedItem]:
+        for document in self._documents(client_data):
+            elements = [ParsedElement(path, value) for path, value in _flatten(document) if value is not None]
             if elements:
-                parsed_items.append(ParsedItem(elements=elements))
+                yield ParsedItem(elements)
+
+    def interpret_client_data(self, client_data: BinaryIO, plan: ColumnMappingPlan,
+                              chunk_size: int) -> Iterator[List[Record]]:
+        interpret_document = plan.bind_paths()
+        documents = self._documents(client_data)
+        while chunk := list(islice(documents, chunk_size)):
+            yield [interpret_document(document) for document in chunk]
+
+
+def _flatten(value: Any, prefix: str = '') -> Iterator[Tuple[str, Any]]:
+    """The leaves of a JSON value with their dotted paths"""
+    if isinstance(value, dict):
+        children = value.items()
+    elif isinstance(value, list):
+        children = ((str(index), child) for index, child in enumerate(value))
+    else:
+        yield prefix, value
+        return
+    for key, child in children:
+        yield from _flatten(child, f"{prefix}.{key}" if prefix else key)
+
+
+class NDJSONParser(JSONDocumentParser):
+    """Newline delimited JSON: one object per line, blank lines are skipped"""
+
+    id = 'ndjson'
+
+    def iter_documents(self, text_stream: TextIO) -> Iterator[Any]:
+        for line in text_stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# The characters of a number or literal that ends the buffer, more of the stream may complete it
+_TRAILING_TOKEN = re.compile(r'[\w+\-.]*\Z')
+
+
+def _cut_off(buffer: str, error: json.JSONDecodeError) -> bool:
+    """Whether decoding failed because the buffer ends before the element does"""
+    # An unterminated string is reported where it starts
+    if error.msg.startswith('Unterminated string'):
+        return True
+    return error.pos >= _TRAILING_TOKEN.search(buffer).start()
+
+
+class JSONArrayParser(JSONDocumentParser):
+    """
+    A top-level JSON array of objects. The array is decoded an element at a time from a sliding buffer of
+    read_size characters, so memory use depends on the size of the largest element and not of the file.
+    """
+
+    id = 'json'
+
+    read_size = 64 * 1024
+
+    def iter_documents(self, text_stream: TextIO) -> Iterator[Any]:
+        decoder = json.JSONDecoder()
+        buffer = ''
+        position = 0
+        eof = False
+
+        def read_more() -> bool:
+            nonlocal buffer, position, eof
+            chunk = text_stream.read(self.read_size)
+            if not chunk:
+                eof = True
+                return False
+            buffer = buffer[position:] + chunk
+            position = 0
+            return True
+
+        def next_char() -> str:
+            # Skip whitespace and return the next character without consuming it, '' at the end of the stream
+            nonlocal position
+            while True:
+                position = _WHITESPACE.match(buffer, position).end()
+                if position < len(buffer) or not read_more():
+                    return buffer[position:position + 1]
+
+        if next_char() != '[':
+            raise ValueError("Expected a JSON array")
+        position += 1
+        if next_char() == ']':
+            position += 1
+        else:
+            while True:
+                while True:
+                    try:
+                        value, end = decoder.raw_decode(buffer, position)
+                    except json.JSONDecodeError as e:
+                        # Only an element cut off at the end of the buffer may decode with more of the stream, a
+                        # malformed one fails at once instead of reading the rest of the file into the buffer
+                        if not _cut_off(buffer, e) or not read_more():
+                            raise
+                        continue
+                    # A number at the end of the buffer may go on in the next read
+                    if end == len(buffer) and not eof and read_more():
+                        continue
+                    break
+                position = end
+                yield value
+
+                separator = next_char()
+                position += 1
+                if separator == ']':
+                    break
+                if separator != ',':
+                    raise ValueError("Expected ',' or ']' after an element of the JSON array")
+                next_char()
 
-        return parsed_items
+        if next_char():
+            raise ValueError("Unexpected data after the JSON array")
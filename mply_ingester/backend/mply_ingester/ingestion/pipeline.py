@@ -0,0 +1,100 @@
+import queue
+import threading
+import time
+from typing import Generic, Iterable, Iterator, TypeVar
+
+T = TypeVar('T')
+
+_DONE = object()
+
+
+class _Raised:
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+class Prefetcher(Generic[T]):
+    """
+    Iterates an iterable in a background thread, up to depth items ahead of the consumer. Used to parse and
+    interpret the next chunks while the current one is written to the database: the bounded queue blocks the
+    parser once it is depth chunks ahead, so memory stays bounded.
+
+    Exceptions of the iterable are raised to the consumer. Close the prefetcher when not iterating it to the end,
+    so the background thread stops.
+    """
+
+    def __init__(self, iterable: Iterable[T], depth: int):
+        self.producer_seconds = 0.0  # Spent producing items, not counting the waits for space in the queue
+        self.wait_seconds = 0.0  # Spent by the consumer waiting for items
+        self._iterator = iter(iterable)
+        self._queue = queue.Queue(maxsize=depth)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._produce, name='ingest-prefetch', daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self) -> None:
+        try:
+            while not self._stopped.is_set():
+                start = time.perf_counter()
+                item = next(self._iterator, _DONE)
+                self.producer_seconds += time.perf_counter() - start
+                if not self._put(item) or item is _DONE:
+                    return
+        except BaseException as e:
+            self._put(_Raised(e))
+        finally:
+            # Let a generator run its clean up, e.g. a parser detaching its text wrapper from the upload
+            close = getattr(self._iterator, 'close', None)
+            if close is not None:
+                close()
+
+    def __iter__(self) -> Iterator[T]:
+        try:
+            while True:
+                start = time.perf_counter()
+                item = self._queue.get()
+                self.wait_seconds += time.perf_counter() - start
+                if item is _DONE:
+                    return
+                if isinstance(item, _Raised):
+                    raise item.exception
+                yield item
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+
+class TimedIterator(Generic[T]):
+    """Iterates an iterable in the calling thread, timed like a Prefetcher where producing is all the waiting"""
+
+    def __init__(self, iterable: Iterable[T]):
+        self.producer_seconds = 0.0
+        self._iterator = iter(iterable)
+
+    @property
+    def wait_seconds(self) -> float:
+        return self.producer_seconds
+
+    def __iter__(self) -> Iterator[T]:
+        while True:
+            start = time.perf_counter()
+            item = next(self._iterator, _DONE)
+            self.producer_seconds += time.perf_counter() - start
+            if item is _DONE:
+                return
+            yield item
+
+    def close(self) -> None:
+        pass
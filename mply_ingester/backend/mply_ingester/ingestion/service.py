@@ -1,10 +1,21 @@
+from collections import deque
+import io
+from itertools import chain, islice
+import shutil
+import tempfile
+import time
+from sqlalchemy import delete, func, insert, select, update
 from sqlalchemy.orm import Session
-from sqlalchemy import update, func
-from typing import List, Set
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional, Union
 
 from mply_ingester.config import ConfigBroker
-from mply_ingester.db.models import Client, ClientProduct
-from mply_ingester.ingestion.base import ParserConfig, ParsedItem, IngestionReport
+from mply_ingester.db.models import Client, IngestionCheckpoint
+from mply_ingester.ingestion.base import (ParserConfig, IngestionProgress, IngestionReport, Record, RejectedRow,
+                                          RejectedRows)
+from mply_ingester.ingestion.dedup import forget_ingests
+from mply_ingester.ingestion.pipeline import Prefetcher, TimedIterator
+from mply_ingester.ingestion.streams import UploadTooLargeError, decompress, limit_size
+from mply_ingester.ingestion.writers import BaseProductWriter, CopyStagingWriter, WriteResult, batched
 
 class DataIngestionService:
     def __init__(self, config_broker: ConfigBroker, db: Session, client: Client):
@@ -12,35 +23,108 @@ class DataIngestionService:
         self.db = db
         self.client = client
 
-    def _extract_skus_from_items(self, parsed_items: List[ParsedItem]) -> Set[str]:
-        """Extract all SKUs from parsed items."""
-        ingested_skus: Set[str] = set()
-        for item in parsed_items:
-            assert item.is_interpreted, "Parsed item is not interpreted"
+    def _records_from_chunks(self, chunks: Iterable[List[Union[Record, RejectedRow]]], progress: IngestionProgress,
+                             rejected: RejectedRows) -> Iterator[Record]:
+        """
+        Flatten the chunks of records from the parser, counting them as parsed and setting the rejected rows aside.
+        Rows are numbered from 1, the first row of data.
+        """
+        row_count = 0
+        for chunk in chunks:
+            progress.add_parsed(len(chunk))
+            for row_number, record in enumerate(chunk, row_count + 1):
+                if type(record) is RejectedRow:
+                    rejected.add(row_number, record)
+                else:
+                    yield record
+            row_count += len(chunk)
+        rejected.check_total(row_count)
 
-            for element in item.elements:
-                if element.column_name == 'sku' and element.value:
-                    ingested_skus.add(element.value)
-                    break
-        return ingested_skus
+    def ingest_data(self, parser_config: ParserConfig, client_data: Union[bytes, BinaryIO],
+                    full_update: bool = False,
+                    progress_callback: Optional[Callable[[int, int], None]] = None,
+                    upload_hash: Optional[str] = None, dry_run: bool = False) -> IngestionReport:
+        """
+        Ingest client data, given either as bytes or as a binary file-like object that is read as a stream.
+        gzip, bz2, xz and single file zip data is decompressed on the fly, up to INGEST_MAX_DECOMPRESSED_SIZE.
+        progress_callback, if given, is called with (rows_parsed, rows_written) as the ingest goes on.
 
-    def ingest_data(self, parser_config: ParserConfig, client_data: bytes, full_update: bool = False) -> IngestionReport:
-        try:
-            parser = self.config_broker.get_parser(parser_config.parser_id)
-            parsed_items = parser.process_client_data(client_data, parser_config.column_mapping)
+        Rows with values that cannot be converted are left out and listed in the report, until there are more of
+        them than the error budget of the parser config, or else INGEST_ERROR_BUDGET, allows. The whole file is
+        then rejected. With INGEST_COMMIT_EVERY, a count is checked as the rows come, so like on any other error
+        the chunks committed before the row over the budget are kept. A percentage is only known once every row
+        has been seen, so it is checked by a first pass over the file before any row is committed, for which
+        non-seekable client_data is spooled to a temporary file.
 
-            ingested_skus = self._extract_skus_from_items(parsed_items) if full_update else None
-            
-            processed_count, deactivated_count = self._apply_to_database(parsed_items, full_update, ingested_skus)
+        The ingest is a single transaction, unless INGEST_COMMIT_EVERY is set: the rows are then committed that many
+        at a time, and if upload_hash (see dedup.hash_upload) is given, with a checkpoint. Ingesting the same upload
+        again after a failure resumes after the last committed row, provided no other ingest of the client
+        succeeded in between.
+
+        With dry_run, nothing is written: the rows are compared with the current products in the database and the
+        stats give the products that would be created, updated, left unchanged and deactivated, the number of
+        products each column would change in and a sample of the differences (see CopyStagingWriter.diff).
+
+        Raises:
+            UploadTooLargeError: If client_data is wrapped with streams.limit_size and goes over the limit, or
+                once decompressed goes over INGEST_MAX_DECOMPRESSED_SIZE
+        """
+        if isinstance(client_data, bytes):
+            client_data = io.BytesIO(client_data)
+        commit_every = self.config_broker['INGEST_COMMIT_EVERY']
+        chunked = bool(commit_every) and not dry_run
+        result = WriteResult()
+        error_budget = parser_config.error_budget
+        rejected = RejectedRows(self.config_broker['INGEST_ERROR_BUDGET'] if error_budget is None else error_budget,
+                                self.config_broker['INGEST_MAX_REPORTED_ERRORS'])
+        try:
+            start = time.perf_counter()
+            if chunked and rejected.max_percent is not None:
+                client_data = self._check_error_budget(parser_config, client_data, rejected)
+                rejected = RejectedRows(rejected.error_budget, rejected.max_reported)
+            progress = IngestionProgress(progress_callback)
+            chunks, records = self._parse(parser_config, client_data, progress, rejected)
+            details = {}
+            try:
+                if dry_run:
+                    result, details = self._diff_with_database(records, full_update, progress)
+                elif chunked:
+                    resumed_count = self._apply_in_chunks(records, full_update, progress, commit_every, upload_hash,
+                                                          result)
+                else:
+                    result = self._apply_to_database(records, full_update, progress)
+            finally:
+                chunks.close()
+            total_seconds = time.perf_counter() - start
+            processed_count, deactivated_count = result.processed_count, result.deactivated_count
             
-            stats = {"processed_count": processed_count}
+            stats = {
+                "processed_count": processed_count,
+                "rejected_count": rejected.count,
+                "created_count": result.created_count,
+                "updated_count": result.updated_count,
+                "unchanged_count": result.unchanged_count,
+                "timings": {
+                    "parse_seconds": round(chunks.producer_seconds, 3),
+                    "write_seconds": round(total_seconds - chunks.wait_seconds, 3),
+                    "total_seconds": round(total_seconds, 3),
+                },
+            }
+            if chunked:
+                stats["resumed_count"] = resumed_count
             if full_update:
                 stats.update({
                     "deactivated_count": deactivated_count,
-                    "total_ingested_skus": len(ingested_skus)
+                    "total_ingested_skus": result.ingested_sku_count
                 })
+            if dry_run:
+                stats["dry_run"] = True
+                stats.update(details)
 
-            if full_update:
+            if dry_run:
+                message = (f"Dry run, nothing was written. {result.created_count} products would be created, "
+                           f"{result.updated_count} updated and {result.deactivated_count} deactivated.")
+            elif full_update:
                 message = f"Full update completed. {processed_count} products processed, {deactivated_count} products deactivated."
             else:
                 message = "Success"
@@ -49,61 +133,159 @@ class DataIngestionService:
                 success=True,
                 message=message,
                 processed_items=processed_count,
-                report=[],
+                report=rejected.reported,
                 stats=stats
             )
 
+        except UploadTooLargeError:
+            self._roll_back_failure(result.processed_count if chunked else 0)
+            raise
         except Exception as e:
+            self._roll_back_failure(result.processed_count if chunked else 0)
             error_type = "full update" if full_update else "data"
+            message = f"Error processing {error_type}: {str(e)}"
+            if chunked and result.processed_count:
+                message += f". {result.processed_count} products were committed before the error"
             return IngestionReport(
                 success=False,
-                message=f"Error processing {error_type}: {str(e)}",
-                processed_items=0,
-                report=[],
-                stats={}
+                message=message,
+                processed_items=result.processed_count,
+                report=rejected.reported,
+                stats={"rejected_count": rejected.count}
             )
     
-    def _apply_to_database(self, parsed_items: List[ParsedItem], full_update: bool = False, ingested_skus: Set[str] = None) -> tuple[int, int]:
-        if full_update and ingested_skus is None:
-            raise ValueError("ingested_skus must be provided when full_update=True")
-        
-        processed_count = 0
-        deactivated_count = 0
-        
+    def _parse(self, parser_config: ParserConfig, client_data: BinaryIO, progress: IngestionProgress,
+               rejected: RejectedRows) -> tuple[Union[Prefetcher, TimedIterator], Iterator[Record]]:
+        """Returns the chunks from the parser, to close once done, and the records of the accepted rows"""
+        client_data, compressed = decompress(client_data)
+        if compressed:
+            client_data = limit_size(client_data, self.config_broker['INGEST_MAX_DECOMPRESSED_SIZE'],
+                                     'Decompressed upload')
+        parser = self.config_broker.get_parser(parser_config.parser_id)
+        chunks = parser.process_client_data(client_data, parser_config.column_mapping)
+
+        # Parse and interpret the next chunks in the background while the current one is written
+        pipeline_depth = self.config_broker['INGEST_PIPELINE_DEPTH']
+        chunks = Prefetcher(chunks, pipeline_depth) if pipeline_depth else TimedIterator(chunks)
+        return chunks, self._records_from_chunks(chunks, progress, rejected)
+
+    def _check_error_budget(self, parser_config: ParserConfig, client_data: BinaryIO,
+                            rejected: RejectedRows) -> BinaryIO:
+        """
+        Parse the whole upload into rejected, before a chunked ingest with a percentage error budget commits
+        anything. Returns client_data rewound for the ingest itself.
+
+        Raises:
+            ErrorBudgetExceededError: If the upload has more rejected rows than the error budget allows
+        """
+        if not client_data.seekable():
+            spooled = tempfile.TemporaryFile()
+            shutil.copyfileobj(client_data, spooled)
+            client_data = spooled
+            client_data.seek(0)
+        start = client_data.tell()
+        chunks, records = self._parse(parser_config, client_data, IngestionProgress(), rejected)
+        try:
+            deque(records, maxlen=0)
+        finally:
+            chunks.close()
+        client_data.seek(start)
+        return client_data
+
+    def _roll_back_failure(self, committed_count: int) -> None:
+        """Roll back a failed ingest. Once it has committed rows, the products match no earlier ingest to replay."""
+        self.db.rollback()
+        if committed_count:
+            forget_ingests(self.db, self.client.id)
+
+    def _get_writer(self, records: Iterator[Record]) -> tuple[BaseProductWriter, Iterator[Record]]:
+        """
+        Pick the configured writer, or the COPY based one for files of at least INGEST_COPY_THRESHOLD rows.
+        Buffers up to the threshold of records to find out, returns the writer and the full record stream.
+        """
+        writer_id = self.config_broker['INGEST_WRITER']
+        copy_threshold = self.config_broker['INGEST_COPY_THRESHOLD']
+        if copy_threshold is not None:
+            head = list(islice(records, copy_threshold))
+            if len(head) >= copy_threshold:
+                writer_id = CopyStagingWriter.id
+            records = chain(head, records)
+        return self.config_broker.get_writer(writer_id, self.db, self.client), records
+
+    def _apply_to_database(self, records: Iterator[Record], full_update: bool = False,
+                           progress: Optional[IngestionProgress] = None) -> WriteResult:
+        writer, records = self._get_writer(records)
+        if progress is not None:
+            writer.progress = progress
+        result = writer.write(records, full_update)
+
+        self._forget_checkpoints()
+        self.db.commit()
+        return result
+
+    def _diff_with_database(self, records: Iterator[Record], full_update: bool,
+                            progress: IngestionProgress) -> tuple[WriteResult, dict]:
+        """Compare the records with the current products through the staging table of the COPY writer, then roll back"""
+        writer = self.config_broker.get_writer(CopyStagingWriter.id, self.db, self.client)
+        writer.progress = progress
+        try:
+            return writer.diff(records, full_update, self.config_broker['INGEST_DRY_RUN_SAMPLE_SIZE'])
+        finally:
+            self.db.rollback()
+
+    def _apply_in_chunks(self, records: Iterator[Record], full_update: bool, progress: IngestionProgress,
+                         commit_every: int, upload_hash: Optional[str], result: WriteResult) -> int:
+        """
+        Write and commit the records commit_every at a time, along with the checkpoint of the upload if upload_hash
+        is given. The full update deactivation only runs once every row is committed. result holds the counts of
+        the committed rows, even if an error stops the ingest.
+
+        Returns:
+            The number of rows skipped as committed by an earlier attempt at the upload
+        """
+        writer, records = self._get_writer(records)
+        writer.progress = progress
+
+        last_existing_id = writer.last_existing_id()
+        checkpoint_id, rows_committed = None, 0
+        if upload_hash is not None:
+            checkpoint = self.db.execute(
+                select(IngestionCheckpoint.id, IngestionCheckpoint.rows_committed, IngestionCheckpoint.last_existing_id)
+                .where(IngestionCheckpoint.client_id == self.client.id, IngestionCheckpoint.upload_hash == upload_hash)
+            ).one_or_none()
+            if checkpoint is None:
+                checkpoint_id = self.db.scalar(insert(IngestionCheckpoint).values(
+                    client_id=self.client.id, upload_hash=upload_hash, last_existing_id=last_existing_id
+                ).returning(IngestionCheckpoint.id))
+            else:
+                checkpoint_id, rows_committed, last_existing_id = checkpoint
+
         if full_update:
-            deactivated_count = self.db.query(ClientProduct).filter(
-                ClientProduct.client_id == self.client.id,
-                ClientProduct.sku.isnot(None),
-                ~ClientProduct.sku.in_(ingested_skus)
-            ).update({
-                'active': False,
-                'last_changed_on': func.current_timestamp()
-            })
-        
-        for item in parsed_items:
-            assert item.is_interpreted, "Parsed item is not interpreted"
-            
-            record_data = {element.column_name: element.value for element in item.elements}
-            if not record_data:
-                continue
-            
-            sku = record_data.get('sku')
-            if sku:
-                existing_record = self.db.query(ClientProduct).filter_by(
-                    sku=sku, client_id=self.client.id
-                ).first()
-                
-                if existing_record:
-                    for key, value in record_data.items():
-                        if key != 'sku' and value is not None:
-                            setattr(existing_record, key, value)
-                    existing_record.last_changed_on = func.current_timestamp()
-                    processed_count += 1
-                    continue
-            
-            db_record = ClientProduct(**(record_data | {'client_id': self.client.id}))
-            self.db.add(db_record)
-            processed_count += 1
-        
+            writer.start_collecting_skus()
+            records = writer.collect_skus(records)
+        # The rows committed before are only parsed, which also collects their SKUs
+        resumed_count = rows_committed
+        result.processed_count = sum(1 for record in islice(records, resumed_count) if record)
+
+        for chunk in batched(records, commit_every):
+            chunk_result = writer.upsert(chunk)
+            rows_committed += len(chunk)
+            if checkpoint_id is not None:
+                self.db.execute(update(IngestionCheckpoint).where(IngestionCheckpoint.id == checkpoint_id).values(
+                    rows_committed=rows_committed, updated_on=func.current_timestamp()
+                ))
+            self.db.commit()
+            result.add_counts(chunk_result)
+            # Keep the identity map from growing over the whole file, the client is still needed
+            self.db.expunge_all()
+            self.db.add(self.client)
+
+        if full_update:
+            writer.finish_full_update(result, last_existing_id)
+        self._forget_checkpoints()
         self.db.commit()
-        return processed_count, deactivated_count
+        return resumed_count
+
+    def _forget_checkpoints(self) -> None:
+        """Once an ingest succeeds, the rows committed by earlier failed ones may be outdated, so none may be resumed"""
+        self.db.execute(delete(IngestionCheckpoint).where(IngestionCheckpoint.client_id == self.client.id))
@@ -0,0 +1,119 @@
+import bz2
+import gzip
+import io
+import lzma
+import shutil
+import tempfile
+import zipfile
+from typing import BinaryIO, Optional
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+class SizeLimitedReader(io.RawIOBase):
+    """Binary reader over another file object that raises once more than max_size bytes have been read from it"""
+
+    def __init__(self, source: BinaryIO, max_size: Optional[int], name: str = 'Upload'):
+        self._source = source
+        self.max_size = max_size
+        self.name = name
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._source.read(len(buffer))
+        self.bytes_read += len(data)
+        if self.max_size is not None and self.bytes_read > self.max_size:
+            raise UploadTooLargeError(f"{self.name} exceeds the maximum size of {self.max_size} bytes")
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seekable(self) -> bool:
+        # SpooledTemporaryFile, as FastAPI uploads are, only has seekable() from Python 3.11
+        seekable = getattr(self._source, 'seekable', None)
+        return seekable() if seekable is not None else hasattr(self._source, 'seek')
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        # The limit applies to the position, so reading again after a rewind does not count twice
+        self.bytes_read = self._source.seek(offset, whence)
+        return self.bytes_read
+
+    def tell(self) -> int:
+        return self._source.tell()
+
+
+def limit_size(source: BinaryIO, max_size: Optional[int], name: str = 'Upload') -> BinaryIO:
+    """Wrap source in a buffered reader that enforces max_size (in bytes, None for no limit) as it is read."""
+    return io.BufferedReader(SizeLimitedReader(source, max_size, name))
+
+
+class _PrefixedReader(io.RawIOBase):
+    """Binary reader that returns prefix, then the rest of source. Puts back the bytes read to sniff a stream."""
+
+    def __init__(self, prefix: bytes, source: BinaryIO):
+        self._prefix = prefix
+        self._source = source
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._prefix:
+            size = min(len(buffer), len(self._prefix))
+            buffer[:size] = self._prefix[:size]
+            self._prefix = self._prefix[size:]
+            return size
+        data = self._source.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _open_zip_member(source: BinaryIO) -> BinaryIO:
+    if not source.seekable():
+        # zipfile reads the central directory at the end of the archive first, spool it to disk to get there
+        spooled = tempfile.TemporaryFile()
+        shutil.copyfileobj(source, spooled)
+        spooled.seek(0)
+        source = spooled
+    archive = zipfile.ZipFile(source)
+    members = [info for info in archive.infolist() if not info.is_dir()]
+    if len(members) != 1:
+        raise ValueError(f"Zip archives must contain a single file, this one has {len(members)}")
+    return archive.open(members[0])
+
+
+# Magic bytes at the start of a compressed stream, and how to open it
+_COMPRESSIONS = [
+    (b'\x1f\x8b', lambda source: gzip.GzipFile(fileobj=source, mode='rb')),
+    (b'BZh', lambda source: bz2.BZ2File(source, mode='rb')),
+    (b'\xfd7zXZ\x00', lambda source: lzma.LZMAFile(source, mode='rb')),
+    (b'PK\x03\x04', _open_zip_member),
+]
+_MAGIC_SIZE = max(len(magic) for magic, _ in _COMPRESSIONS)
+
+
+def decompress(source: BinaryIO) -> tuple[BinaryIO, bool]:
+    """
+    Detect a gzip, bz2, xz or single file zip stream by its magic bytes and wrap it in a reader that decompresses
+    it as it is read. Returns the stream to read and whether it was compressed. Other streams are returned as they
+    are, apart from the bytes read to detect them being put back in front.
+
+    Raises:
+        ValueError: If a zip archive does not contain exactly one file
+    """
+    if source.seekable():
+        start = source.tell()
+        head = source.read(_MAGIC_SIZE)
+        source.seek(start)
+    else:
+        head = source.read(_MAGIC_SIZE)
+        source = io.BufferedReader(_PrefixedReader(head, source))
+
+    for magic, open_compressed in _COMPRESSIONS:
+        if head.startswith(magic):
+            return open_compressed(source), True
+    return source, False
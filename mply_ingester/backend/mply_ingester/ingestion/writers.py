@@ -0,0 +1,526 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+import io
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import bindparam, func, insert, select, text, update
+from sqlalchemy.orm import Session
+
+from mply_ingester.config import ConfigBroker
+from mply_ingester.db.models import Client, ClientProduct
+from mply_ingester.ingestion.base import IngestionProgress, Record
+
+
+@dataclass
+class WriteResult:
+    processed_count: int = 0
+    deactivated_count: int = 0
+    ingested_sku_count: int = 0
+    # Products inserted, existing products that got at least one new value, and existing products left as they were
+    created_count: int = 0
+    updated_count: int = 0
+    unchanged_count: int = 0
+
+    def add_counts(self, other: 'WriteResult') -> None:
+        self.processed_count += other.processed_count
+        self.created_count += other.created_count
+        self.updated_count += other.updated_count
+        self.unchanged_count += other.unchanged_count
+
+
+def batched(records: Iterable[Record], batch_size: int) -> Iterator[List[Record]]:
+    """Yield lists of at most batch_size records."""
+    iterator = iter(records)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+class BaseProductWriter(ABC):
+    """Write interpreted records into client_products for a single client"""
+
+    id = None
+
+    ingested_skus_table = 'ingested_skus'
+
+    def __init__(self, config_broker: ConfigBroker, db: Session, client: Client):
+        self.config_broker = config_broker
+        self.db = db
+        self.client = client
+        self.progress = IngestionProgress()
+
+    def write(self, records: Iterable[Record], full_update: bool = False) -> WriteResult:
+        """
+        Apply the records to the database, consuming them as a stream. In full update mode, any product of the
+        client that existed before the write and whose SKU is not among the records is deactivated afterwards.
+        Does not commit.
+        """
+        if not full_update:
+            return self.upsert(records)
+
+        last_existing_id = self.last_existing_id()
+        self.start_collecting_skus()
+        result = self.upsert(self.collect_skus(records))
+        self.finish_full_update(result, last_existing_id)
+        return result
+
+    def last_existing_id(self) -> Optional[int]:
+        """The id of the client's latest product, the products created after it are never deactivated"""
+        return self.db.scalar(select(func.max(ClientProduct.id)).where(ClientProduct.client_id == self.client.id))
+
+    def start_collecting_skus(self) -> None:
+        """
+        Create the temporary table collect_skus fills. The ingested SKUs go there batch by batch as the records
+        stream past, so that the deactivation is an anti-join instead of a NOT IN over every SKU of the file. Without
+        an index, as loading it is what takes the time and the anti-join hashes the table anyway. It outlives commits,
+        for ingests that commit as they go.
+        """
+        self.db.execute(text(f"DROP TABLE IF EXISTS {self.ingested_skus_table}"))
+        self.db.execute(text(f"CREATE TEMPORARY TABLE {self.ingested_skus_table} (sku TEXT NOT NULL)"))
+
+    def collect_skus(self, records: Iterable[Record]) -> Iterator[Record]:
+        """Pass the records through, storing their SKUs in the table made by start_collecting_skus"""
+        insert_skus = text(f"INSERT INTO {self.ingested_skus_table} (sku) SELECT unnest(CAST(:skus AS TEXT[]))")
+        batch_size = self.config_broker['INGEST_BATCH_SIZE']
+        skus = []
+        for record in records:
+            if record.get('sku'):
+                skus.append(record['sku'])
+                if len(skus) >= batch_size:
+                    self.db.execute(insert_skus, {'skus': skus})
+                    skus = []
+            yield record
+        if skus:
+            self.db.execute(insert_skus, {'skus': skus})
+
+    def finish_full_update(self, result: WriteResult, last_existing_id: Optional[int]) -> None:
+        """Deactivate the products absent from the collected SKUs and drop their table, counting both into result"""
+        self.db.execute(text(f"ANALYZE {self.ingested_skus_table}"))
+        if last_existing_id is not None:
+            result.deactivated_count = self.deactivate_absent(last_existing_id)
+        result.ingested_sku_count = self.db.scalar(text(f"SELECT count(DISTINCT sku) FROM {self.ingested_skus_table}"))
+        self.db.execute(text(f"DROP TABLE {self.ingested_skus_table}"))
+
+    def deactivate_absent(self, last_existing_id: int) -> int:
+        """Deactivate the active products up to last_existing_id whose SKU is not in the ingested SKUs table"""
+        return self.db.execute(text(f"""
+            UPDATE client_products cp
+            SET active = false, last_changed_on = current_timestamp
+            WHERE cp.client_id = :client_id
+              AND cp.id <= :last_existing_id
+              AND cp.active
+              AND cp.sku IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM {self.ingested_skus_table} i WHERE i.sku = cp.sku)
+        """), {'client_id': self.client.id, 'last_existing_id': last_existing_id}).rowcount
+
+    @abstractmethod
+    def upsert(self, records: Iterable[Record]) -> WriteResult:
+        """
+        Create or update the given records. Records with a SKU that already exists for the client update
+        that product, any value that is not supplied (None) is left untouched. Products whose supplied values
+        all match the stored ones are not written at all, so their last_changed_on stays as it was.
+        Does not commit.
+
+        Returns:
+            The number of records processed, and of products created, updated and left unchanged
+        """
+        pass
+
+
+class RowByRowWriter(BaseProductWriter):
+    """Looks up and writes every record individually through the ORM"""
+
+    id = 'row'
+
+    def upsert(self, records: Iterable[Record]) -> WriteResult:
+        result = WriteResult()
+        for record_data in records:
+            if not record_data:
+                continue
+            result.processed_count += 1
+
+            sku = record_data.get('sku')
+            if sku:
+                existing_record = self.db.query(ClientProduct).filter_by(
+                    sku=sku, client_id=self.client.id
+                ).first()
+
+                if existing_record:
+                    changes = {
+                        key: value for key, value in record_data.items()
+                        if key != 'sku' and value is not None and getattr(existing_record, key) != value
+                    }
+                    if not changes:
+                        result.unchanged_count += 1
+                        continue
+                    for key, value in changes.items():
+                        setattr(existing_record, key, value)
+                    existing_record.last_changed_on = func.current_timestamp()
+                    result.updated_count += 1
+                    continue
+
+            db_record = ClientProduct(**(record_data | {'client_id': self.client.id}))
+            self.db.add(db_record)
+            result.created_count += 1
+
+        self.progress.add_written(result.processed_count)
+        return result
+
+
+class BulkUpsertWriter(BaseProductWriter):
+    """
+    Resolves all SKUs of a batch, along with their current values, with a single query, then issues one batched
+    INSERT for the new products and batched UPDATEs (grouped by the set of changed columns) for the existing ones
+    that actually changed.
+    """
+
+    id = 'bulk'
+
+    def upsert(self, records: Iterable[Record]) -> WriteResult:
+        result = WriteResult()
+        for batch in batched(records, self.config_broker['INGEST_BATCH_SIZE']):
+            batch_result = self._upsert_batch(batch)
+            self.progress.add_written(batch_result.processed_count)
+            result.add_counts(batch_result)
+        return result
+
+    def _upsert_batch(self, batch: List[Record]) -> WriteResult:
+        skus = {record['sku'] for record in batch if record.get('sku')}
+        existing_by_sku = {}
+        if skus:
+            table = ClientProduct.__table__
+            existing_by_sku = {
+                row['sku']: row for row in self.db.execute(
+                    select(table).where(table.c.client_id == self.client.id, table.c.sku.in_(skus))
+                ).mappings()
+            }
+
+        new_records: List[Record] = []
+        new_records_by_sku: Dict[str, Record] = {}
+        supplied_by_sku: Dict[str, Record] = {}
+        result = WriteResult()
+
+        for record in batch:
+            if not record:
+                continue
+            result.processed_count += 1
+
+            sku = record.get('sku')
+            supplied = {key: value for key, value in record.items() if value is not None}
+            if sku and sku in existing_by_sku:
+                supplied.pop('sku')
+                supplied_by_sku.setdefault(sku, {}).update(supplied)
+            elif sku and sku in new_records_by_sku:
+                # The same new SKU appears more than once, later values win
+                new_records_by_sku[sku].update(supplied)
+            else:
+                new_record = dict(record) | {'client_id': self.client.id}
+                new_records.append(new_record)
+                if sku:
+                    new_records_by_sku[sku] = new_record
+
+        # Only write the values that differ from the stored ones, and skip the products where none do
+        updates_by_id: Dict[int, Record] = {}
+        for sku, supplied in supplied_by_sku.items():
+            existing = existing_by_sku[sku]
+            changes = {key: value for key, value in supplied.items() if existing[key] != value}
+            if changes:
+                updates_by_id[existing['id']] = changes
+        result.created_count = len(new_records)
+        result.updated_count = len(updates_by_id)
+        result.unchanged_count = len(supplied_by_sku) - len(updates_by_id)
+
+        if new_records:
+            self.db.execute(insert(ClientProduct), new_records)
+        self._update_by_id(updates_by_id)
+
+        return result
+
+    def _update_by_id(self, updates_by_id: Dict[int, Record]) -> None:
+        # executemany needs the same parameters for every row, so group the rows by the columns they change
+        groups: Dict[tuple, List[Record]] = {}
+        for product_id, values in updates_by_id.items():
+            columns = tuple(sorted(values))
+            groups.setdefault(columns, []).append(values | {'_id': product_id})
+
+        table = ClientProduct.__table__
+        for columns, rows in groups.items():
+            stmt = (
+                update(table)
+                .where(table.c.id == bindparam('_id'))
+                .values({column: bindparam(column) for column in columns})
+                .values(last_changed_on=func.current_timestamp())
+            )
+            self.db.execute(stmt, rows)
+
+
+class _ChunkReader(io.RawIOBase):
+    """Read-only binary file object over an iterator of byte chunks, used as the COPY input"""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._pending = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            self._pending = next(self._chunks, b'')
+            if not self._pending:
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def _copy_text_value(value: Any) -> str:
+    """Format a value for COPY's text format"""
+    if value is None:
+        return '\\N'
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+class CopyStagingWriter(BaseProductWriter):
+    """
+    Streams the records into a temporary staging table with COPY FROM STDIN and merges the staging table into
+    client_products with set based statements. Meant for very large files, where even batched INSERTs are slow.
+    """
+
+    id = 'copy'
+
+    staging_table = 'client_products_staging'
+    staged_columns = [
+        column for column in ClientProduct.__table__.columns
+        if column.name not in ('id', 'client_id')
+    ]
+    # Values to insert when a column is not supplied, mirroring the server defaults of client_products
+    insert_defaults = {
+        'active': 'true',
+        'last_changed_on': 'current_timestamp',
+    }
+
+    def upsert(self, records: Iterable[Record]) -> WriteResult:
+        return self.write(records)
+
+    def write(self, records: Iterable[Record], full_update: bool = False) -> WriteResult:
+        result = WriteResult(processed_count=self._load_staging_table(records))
+
+        if full_update:
+            # Runs before the merge, so the products created by it are never deactivated
+            result.deactivated_count = self._deactivate_absent_from_staging()
+            result.ingested_sku_count = self.db.scalar(text(
+                f"SELECT count(DISTINCT sku) FROM {self.staging_table} WHERE sku <> ''"
+            ))
+        self._merge_staging_table(result)
+        self.progress.add_written(result.processed_count)
+
+        self.db.execute(text(f"DROP TABLE {self.staging_table}"))
+        return result
+
+    diff_table = 'client_products_diff'
+
+    def diff(self, records: Iterable[Record], full_update: bool = False,
+             sample_size: int = 10) -> Tuple[WriteResult, Dict[str, Any]]:
+        """
+        Work out what write would do, with set based queries and without changing client_products: the counts of
+        the WriteResult, how many products every column would change in, and up to sample_size of the products
+        that would be created, updated (with their old and new values) and deactivated. The staging tables are
+        left for the caller to roll back.
+        """
+        result = WriteResult(processed_count=self._load_staging_table(records))
+        params = {'client_id': self.client.id, 'sample_size': sample_size}
+        compared = [column.name for column in self.staged_columns if column.name not in ('sku', 'last_changed_on')]
+        changed = {name: f"COALESCE(d.{name}, cp.{name}) IS DISTINCT FROM cp.{name}" for name in compared}
+        any_changed = ' OR '.join(changed.values())
+
+        self.db.execute(text(f"""
+            CREATE TEMPORARY TABLE {self.diff_table} ON COMMIT DROP AS
+            SELECT latest.*, cp.id AS product_id
+            FROM ({self._latest_per_sku()}) latest
+            LEFT JOIN client_products cp ON cp.client_id = :client_id AND cp.sku = latest.sku
+        """), params)
+        self.db.execute(text(f"ANALYZE {self.diff_table}"))
+
+        column_counts = ', '.join(
+            f"count(*) FILTER (WHERE d.product_id IS NOT NULL AND {condition}) AS {name}"
+            for name, condition in changed.items()
+        )
+        counts = self.db.execute(text(f"""
+            SELECT count(*) FILTER (WHERE d.product_id IS NULL) AS created_count,
+                   count(*) FILTER (WHERE d.product_id IS NOT NULL AND ({any_changed})) AS updated_count,
+                   count(*) FILTER (WHERE d.product_id IS NOT NULL AND NOT ({any_changed})) AS unchanged_count,
+                   count(*) AS sku_count,
+                   {column_counts}
+            FROM {self.diff_table} d LEFT JOIN client_products cp ON cp.id = d.product_id
+        """)).mappings().one()
+        # Rows without a SKU always create a product
+        created_without_sku = self.db.scalar(text(
+            f"SELECT count(*) FROM {self.staging_table} WHERE sku IS NULL OR sku = ''"
+        ))
+        result.created_count = counts['created_count'] + created_without_sku
+        result.updated_count = counts['updated_count']
+        result.unchanged_count = counts['unchanged_count']
+
+        new_and_old = ', '.join(f"d.{name} AS new_{name}, cp.{name} AS old_{name}" for name in compared)
+        updated = self.db.execute(text(f"""
+            SELECT d.sku, {new_and_old}
+            FROM {self.diff_table} d JOIN client_products cp ON cp.id = d.product_id
+            WHERE {any_changed}
+            ORDER BY d.row_num
+            LIMIT :sample_size
+        """), params).mappings().all()
+        sample = {
+            'created': [dict(row) for row in self.db.execute(text(f"""
+                SELECT d.sku, d.title FROM {self.diff_table} d WHERE d.product_id IS NULL ORDER BY d.row_num
+                LIMIT :sample_size
+            """), params).mappings()],
+            'updated': [
+                {'sku': row['sku'], 'changes': {
+                    name: {'old': row[f'old_{name}'], 'new': row[f'new_{name}']}
+                    for name in compared
+                    if row[f'new_{name}'] is not None and row[f'new_{name}'] != row[f'old_{name}']
+                }}
+                for row in updated
+            ],
+            'deactivated': [],
+        }
+
+        if full_update:
+            result.ingested_sku_count = counts['sku_count']
+            absent = f"""
+                FROM client_products cp
+                WHERE cp.client_id = :client_id
+                  AND cp.active
+                  AND cp.sku IS NOT NULL
+                  AND NOT EXISTS (SELECT 1 FROM {self.diff_table} d WHERE d.sku = cp.sku)
+            """
+            result.deactivated_count = self.db.scalar(text(f"SELECT count(*) {absent}"), params)
+            sample['deactivated'] = [dict(row) for row in self.db.execute(text(
+                f"SELECT cp.sku, cp.title {absent} ORDER BY cp.sku LIMIT :sample_size"
+            ), params).mappings()]
+
+        details = {
+            'changed_columns': {name: counts[name] for name in compared if counts[name]},
+            'sample': sample,
+        }
+        return result, details
+
+    def _load_staging_table(self, records: Iterable[Record]) -> int:
+        dialect = self.db.get_bind().dialect
+        column_ddl = ', '.join(f"{column.name} {column.type.compile(dialect=dialect)}" for column in self.staged_columns)
+        self.db.execute(text(f"DROP TABLE IF EXISTS {self.staging_table}"))
+        self.db.execute(text(
+            f"CREATE TEMPORARY TABLE {self.staging_table} (row_num BIGINT NOT NULL, {column_ddl}) ON COMMIT DROP"
+        ))
+
+        row_count = 0
+        records_error = None
+
+        def copy_chunks() -> Iterator[bytes]:
+            nonlocal row_count, records_error
+            try:
+                for batch in batched(records, self.config_broker['INGEST_BATCH_SIZE']):
+                    lines = []
+                    for record in batch:
+                        if not record:
+                            continue
+                        row_count += 1
+                        values = [str(row_count)] + [_copy_text_value(record.get(column.name))
+                                                     for column in self.staged_columns]
+                        lines.append('\t'.join(values))
+                    if lines:
+                        yield ('\n'.join(lines) + '\n').encode('utf-8')
+            except Exception as e:
+                records_error = e
+                raise
+
+        column_names = ', '.join(['row_num'] + [column.name for column in self.staged_columns])
+        cursor = self.db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {self.staging_table} ({column_names}) FROM STDIN",
+                io.BufferedReader(_ChunkReader(copy_chunks()))
+            )
+        except Exception:
+            # psycopg2 wraps an error raised while it reads the COPY input in its own, raise the original instead,
+            # as the other writers do
+            if records_error is not None:
+                raise records_error from None
+            raise
+        finally:
+            cursor.close()
+        self.db.execute(text(f"ANALYZE {self.staging_table}"))
+        return row_count
+
+    def _deactivate_absent_from_staging(self) -> int:
+        result = self.db.execute(text(f"""
+            UPDATE client_products cp
+            SET active = false, last_changed_on = current_timestamp
+            WHERE cp.client_id = :client_id
+              AND cp.active
+              AND cp.sku IS NOT NULL
+              AND NOT EXISTS (
+                  SELECT 1 FROM {self.staging_table} s WHERE s.sku = cp.sku AND s.sku <> ''
+              )
+        """), {'client_id': self.client.id})
+        return result.rowcount
+
+    def _latest_per_sku(self) -> str:
+        """Query collapsing the repeated SKUs of the staging table into one row with the last supplied values"""
+        names = [column.name for column in self.staged_columns if column.name != 'sku']
+        latest_values = ', '.join(
+            f"(array_agg({name} ORDER BY row_num DESC) FILTER (WHERE {name} IS NOT NULL))[1] AS {name}"
+            for name in names
+        )
+        return f"""
+            SELECT max(row_num) AS row_num, sku, {latest_values}
+            FROM {self.staging_table}
+            WHERE sku <> ''
+            GROUP BY sku
+        """
+
+    def _merge_staging_table(self, result: WriteResult) -> None:
+        names = [column.name for column in self.staged_columns]
+        latest_per_sku = self._latest_per_sku()
+
+        matched_count = self.db.scalar(text(f"""
+            SELECT count(DISTINCT s.sku)
+            FROM {self.staging_table} s JOIN client_products cp ON cp.client_id = :client_id AND cp.sku = s.sku
+            WHERE s.sku <> ''
+        """), {'client_id': self.client.id})
+
+        updated_names = [name for name in names if name not in ('sku', 'last_changed_on')]
+        assignments = ', '.join(f"{name} = COALESCE(s.{name}, cp.{name})" for name in updated_names)
+        # Leave the products alone when every supplied value matches the stored one
+        changed = ' OR '.join(f"COALESCE(s.{name}, cp.{name}) IS DISTINCT FROM cp.{name}" for name in updated_names)
+        result.updated_count = self.db.execute(text(f"""
+            UPDATE client_products cp
+            SET {assignments}, last_changed_on = current_timestamp
+            FROM ({latest_per_sku}) s
+            WHERE cp.client_id = :client_id AND cp.sku = s.sku AND ({changed})
+        """), {'client_id': self.client.id}).rowcount
+        result.unchanged_count = matched_count - result.updated_count
+
+        insert_values = ', '.join(
+            f"COALESCE(s.{name}, {self.insert_defaults[name]})" if name in self.insert_defaults else f"s.{name}"
+            for name in names
+        )
+        result.created_count = self.db.execute(text(f"""
+            INSERT INTO client_products (client_id, {', '.join(names)})
+            SELECT :client_id, {insert_values}
+            FROM (
+                SELECT row_num, {', '.join(names)} FROM ({latest_per_sku}) latest
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM client_products cp WHERE cp.client_id = :client_id AND cp.sku = latest.sku
+                )
+                UNION ALL
+                SELECT row_num, {', '.join(names)} FROM {self.staging_table} WHERE sku IS NULL OR sku = ''
+            ) s
+            ORDER BY s.row_num
+        """), {'client_id': self.client.id}).rowcount
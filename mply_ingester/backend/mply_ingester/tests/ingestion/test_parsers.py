@@ -0,0 +1,284 @@
+import gc
+import io
+import json
+import tracemalloc
+import unittest
+from decimal import Decimal
+
+from mply_ingester.config import ConfigBroker
+from mply_ingester.ingestion.base import CellError, ColumnMappingPlan, RejectedRow
+from mply_ingester.ingestion.parsers import CSVParser, JSONArrayParser, NDJSONParser
+from mply_ingester.ingestion.transformers import BaseTransformer
+
+
+COLUMN_MAPPING = {
+    "sku": ("sku", "text"),
+    "title": ("title", "text"),
+    "price": ("reference_price", "decimal"),
+    "active": ("active", "boolean"),
+}
+
+
+class GeneratedCSV(io.RawIOBase):
+    """A CSV file that is generated while it is read, so the file itself never sits in memory."""
+
+    def __init__(self, num_rows):
+        self._lines = self._generate(num_rows)
+        self._pending = b""
+
+    @staticmethod
+    def _generate(num_rows):
+        yield "sku,title,price,active\n".encode("utf-8")
+        for i in range(num_rows):
+            yield f'SKU{i},"Product {i}, ünïcode",£{i}.99,1\n'.encode("utf-8")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            self._pending = next(self._lines, b"")
+            if not self._pending:
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+class CSVParserTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.config_broker = ConfigBroker([])
+        cls.parser = CSVParser(cls.config_broker)
+
+    def test_process_client_data_yields_bounded_chunks(self):
+        chunk_size = self.config_broker['INGEST_BATCH_SIZE']
+        num_rows = chunk_size * 2 + 5
+        chunks = list(self.parser.process_client_data(io.BufferedReader(GeneratedCSV(num_rows)), COLUMN_MAPPING))
+
+        self.assertEqual([len(chunk) for chunk in chunks], [chunk_size, chunk_size, 5])
+        last = chunks[-1][-1]
+        self.assertEqual(last["sku"], f"SKU{num_rows - 1}")
+        self.assertEqual(last["title"], f"Product {num_rows - 1}, ünïcode")
+        self.assertTrue(last["active"])
+
+    def test_parse_does_not_close_the_file(self):
+        data = io.BytesIO(b"sku,title\nA,Product A\n")
+        items = list(self.parser.parse_client_data(data))
+        self.assertEqual(len(items), 1)
+        self.assertFalse(data.closed)
+
+    def test_plan_matches_item_by_item_interpretation(self):
+        data = (
+            b" sku ,price,title,active,price,unmapped\n"
+            b"A,$1.00,Product A,yes,$2.50,x\n"
+            b"\n"
+            b"B,,Product B\n"
+            b"C,3,Product C,0,4,y,extra\n"
+        )
+        column_mapping = dict(COLUMN_MAPPING, missing=("brand", "text"))
+
+        records = [record for chunk in self.parser.process_client_data(io.BytesIO(data), column_mapping)
+                   for record in chunk]
+
+        expected = []
+        for item in self.parser.parse_client_data(io.BytesIO(data)):
+            item.interpret(self.config_broker, column_mapping)
+            expected.append({element.column_name: element.value for element in item.elements})
+        self.assertEqual(records, expected)
+        self.assertEqual(records[0], {"sku": "A", "reference_price": Decimal("2.50"), "title": "Product A",
+                                      "active": True})
+        self.assertEqual(records[1], {"sku": "B", "title": "Product B"})
+
+    def test_rows_with_bad_values_are_rejected(self):
+        data = (
+            b"sku,price,title,active\n"
+            b"A,$1.00,Product A,yes\n"
+            b"B,N/A,Product B,maybe\n"
+            b"C,3,Product C\n"
+            b"D,x\n"
+        )
+        records = [record for chunk in self.parser.process_client_data(io.BytesIO(data), COLUMN_MAPPING)
+                   for record in chunk]
+
+        self.assertEqual(records[0], {"sku": "A", "reference_price": Decimal("1.00"), "title": "Product A",
+                                      "active": True})
+        self.assertEqual(records[1], RejectedRow([
+            CellError("price", "N/A", "Invalid decimal value: N/A"),
+            CellError("active", "maybe", "Invalid boolean value: maybe"),
+        ]))
+        self.assertEqual(records[2], {"sku": "C", "reference_price": Decimal("3"), "title": "Product C"})
+        self.assertEqual(records[3], RejectedRow([CellError("price", "x", "Invalid decimal value: x")]))
+
+    def test_transformer_bugs_are_not_rejected_rows(self):
+        class BuggyTransformer(BaseTransformer):
+            def transform(self, value):
+                return value["not a dict"]
+
+        plan = ColumnMappingPlan({"sku": ("sku", BuggyTransformer())})
+        with self.assertRaises(TypeError):
+            plan.bind(["sku"])(["A"])
+        with self.assertRaises(TypeError):
+            plan.bind_columns(["sku"])([["A"], ["B"]])
+        with self.assertRaises(TypeError):
+            plan.bind_paths()({"sku": "A"})
+
+    def test_plan_rejects_unknown_columns_and_transformers(self):
+        with self.assertRaisesRegex(ValueError, "Unknown multiply column"):
+            ColumnMappingPlan.compile(self.config_broker, {"sku": ("not_a_column", "text")})
+        with self.assertRaisesRegex(ValueError, "Unknown transformer"):
+            ColumnMappingPlan.compile(self.config_broker, {"sku": ("sku", "not_a_transformer")})
+
+    def peak_memory_while_processing(self, num_rows):
+        gc.collect()
+        tracemalloc.start()
+        try:
+            stream = io.BufferedReader(GeneratedCSV(num_rows))
+            processed = sum(len(chunk) for chunk in self.parser.process_client_data(stream, COLUMN_MAPPING))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(processed, num_rows)
+        return peak
+
+    def test_memory_stays_flat_with_file_size(self):
+        chunk_size = self.config_broker['INGEST_BATCH_SIZE']
+        small_peak = self.peak_memory_while_processing(chunk_size * 2)
+        large_peak = self.peak_memory_while_processing(chunk_size * 20)
+
+        # Ten times the rows must not need meaningfully more memory
+        self.assertLess(large_peak, small_peak * 1.5)
+
+
+JSON_PRODUCTS = [
+    {"sku": "A", "name": {"en": "Product A"}, "price": {"amount": "1.50"}, "images": [{"url": "a.png"}],
+     "flags": {"active": True}},
+    {"sku": "B", "name": {"en": "Product \u00fc, \"B\""}, "price": {"amount": 2}, "images": [],
+     "flags": {"active": "no"}, "stock": None},
+    {"sku": "C", "dotted.key": "found"},
+]
+JSON_COLUMN_MAPPING = {
+    "sku": ("sku", "text"),
+    "name.en": ("title", "text"),
+    "price.amount": ("reference_price", "decimal"),
+    "images.0.url": ("remote_id", "text"),
+    "flags.active": ("active", "boolean"),
+    "stock": ("stock_quantity", "integer"),
+    "dotted.key": ("brand", "text"),
+}
+JSON_RECORDS = [
+    {"sku": "A", "title": "Product A", "reference_price": Decimal("1.50"), "remote_id": "a.png", "active": True},
+    {"sku": "B", "title": "Product ü, \"B\"", "reference_price": Decimal("2"), "active": False},
+    {"sku": "C", "brand": "found"},
+]
+
+
+class GeneratedJSONArray(GeneratedCSV):
+    @staticmethod
+    def _generate(num_rows):
+        yield b"["
+        for i in range(num_rows):
+            separator = "," if i else ""
+            yield f'{separator}\n  {{"sku": "SKU{i}", "name": {{"en": "Product {i}"}}, "price": {{"amount": {i}.99}}}}'.encode("utf-8")
+        yield b"\n]\n"
+
+
+class SmallReadJSONArrayParser(JSONArrayParser):
+    # Every element spans several reads
+    read_size = 7
+
+
+class JSONParserTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.config_broker = ConfigBroker([])
+
+    def records(self, parser, data):
+        return [record for chunk in parser.process_client_data(io.BytesIO(data), JSON_COLUMN_MAPPING)
+                for record in chunk]
+
+    def test_objects_with_bad_values_are_rejected(self):
+        data = b'{"sku": "A", "stock": 3}\n{"sku": "B", "flags": {"active": "maybe"}}\n'
+        self.assertEqual(self.records(NDJSONParser(self.config_broker), data), [
+            {"sku": "A", "stock_quantity": 3},
+            RejectedRow([CellError("flags.active", "maybe", "Invalid boolean value: maybe")]),
+        ])
+
+    def test_parsers_are_registered(self):
+        self.assertIsInstance(self.config_broker.get_parser("ndjson"), NDJSONParser)
+        self.assertIsInstance(self.config_broker.get_parser("json"), JSONArrayParser)
+
+    def test_ndjson(self):
+        data = "\n".join(json.dumps(product) for product in JSON_PRODUCTS).encode("utf-8") + b"\n\n"
+        self.assertEqual(self.records(NDJSONParser(self.config_broker), data), JSON_RECORDS)
+
+    def test_json_array(self):
+        for data in (json.dumps(JSON_PRODUCTS), json.dumps(JSON_PRODUCTS, indent=4, ensure_ascii=False)):
+            for parser_cls in (JSONArrayParser, SmallReadJSONArrayParser):
+                with self.subTest(parser=parser_cls.__name__):
+                    parser = parser_cls(self.config_broker)
+                    self.assertEqual(self.records(parser, data.encode("utf-8")), JSON_RECORDS)
+
+    def test_json_array_of_numbers_split_across_reads(self):
+        parser = SmallReadJSONArrayParser(self.config_broker)
+        values = list(parser.iter_documents(io.StringIO("[123456, 1234567890123, [], \"x\"]")))
+        self.assertEqual(values, [123456, 1234567890123, [], "x"])
+
+    def test_empty_json_array(self):
+        self.assertEqual(self.records(JSONArrayParser(self.config_broker), b" [ ] "), [])
+
+    def test_invalid_json_array(self):
+        parser = SmallReadJSONArrayParser(self.config_broker)
+        for data in (b'{"sku": "A"}', b'[{"sku": "A"},]', b'[{"sku": "A"}', b'[{"sku": "A"}] x', b'[1, 2]'):
+            with self.subTest(data=data), self.assertRaises(ValueError):
+                self.records(parser, data)
+
+    def test_json_array_elements_cut_off_anywhere(self):
+        data = json.dumps([*JSON_PRODUCTS, {"sku": "D", "escaped": "\u00fc\n\"", "flags": [True, None, -1.5e-3]}])
+        expected = json.loads(data)
+        for read_size in range(1, 40):
+            with self.subTest(read_size=read_size):
+                parser = JSONArrayParser(self.config_broker)
+                parser.read_size = read_size
+                self.assertEqual(list(parser.iter_documents(io.StringIO(data))), expected)
+
+    def test_malformed_json_array_element_fails_at_once(self):
+        element = '{"sku": "SKU%d", "title": "Product"}'
+        for malformed in ('{"sku": "A" "title": "Product"}', '{"sku": tru, "title": "Product"}', '{sku: "A"}'):
+            with self.subTest(malformed=malformed):
+                elements = [element % 0, malformed] + [element % i for i in range(10000)]
+                text_stream = io.StringIO("[" + ", ".join(elements) + "]")
+                with self.assertRaises(json.JSONDecodeError):
+                    list(JSONArrayParser(self.config_broker).iter_documents(text_stream))
+                # Not the rest of the file
+                self.assertEqual(text_stream.tell(), JSONArrayParser.read_size)
+
+    def test_json_array_memory_stays_flat_with_file_size(self):
+        parser = JSONArrayParser(self.config_broker)
+        chunk_size = self.config_broker['INGEST_BATCH_SIZE']
+
+        def peak_memory(num_rows):
+            gc.collect()
+            tracemalloc.start()
+            try:
+                stream = io.BufferedReader(GeneratedJSONArray(num_rows))
+                processed = sum(len(chunk) for chunk in parser.process_client_data(stream, JSON_COLUMN_MAPPING))
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            self.assertEqual(processed, num_rows)
+            return peak
+
+        self.assertLess(peak_memory(chunk_size * 20), peak_memory(chunk_size * 2) * 1.5)
+
+    def test_parse_client_data_flattens_paths(self):
+        data = json.dumps(JSON_PRODUCTS[:1]).encode("utf-8")
+        item = next(JSONArrayParser(self.config_broker).parse_client_data(io.BytesIO(data)))
+        self.assertEqual({element.column_name: element.value for element in item.elements}, {
+            "sku": "A", "name.en": "Product A", "price.amount": "1.50", "images.0.url": "a.png", "flags.active": True
+        })
+
+
+if __name__ == "__main__":
+    unittest.main()
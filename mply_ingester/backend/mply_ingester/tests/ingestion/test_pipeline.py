@@ -0,0 +1,66 @@
+import threading
+import time
+import unittest
+
+from mply_ingester.ingestion.pipeline import Prefetcher, TimedIterator
+
+
+class PrefetcherTestCase(unittest.TestCase):
+    def test_yields_items_in_order(self):
+        self.assertEqual(list(Prefetcher(range(100), 3)), list(range(100)))
+
+    def test_stays_bounded_ahead_of_the_consumer(self):
+        produced = []
+
+        def items():
+            for i in range(50):
+                produced.append(i)
+                yield i
+
+        prefetcher = Prefetcher(items(), 2)
+        iterator = iter(prefetcher)
+        next(iterator)
+        # Give the producer time to fill the queue
+        time.sleep(0.2)
+        # The queue holds 2 items, and one more waits to be put
+        self.assertLessEqual(len(produced), 4)
+        prefetcher.close()
+
+    def test_raises_errors_of_the_iterable_to_the_consumer(self):
+        def items():
+            yield 1
+            raise ValueError("Bad row")
+
+        iterator = iter(Prefetcher(items(), 2))
+        self.assertEqual(next(iterator), 1)
+        with self.assertRaisesRegex(ValueError, "Bad row"):
+            next(iterator)
+
+    def test_close_stops_the_producer_and_closes_the_generator(self):
+        closed = threading.Event()
+
+        def items():
+            try:
+                i = 0
+                while True:
+                    yield i
+                    i += 1
+            finally:
+                closed.set()
+
+        prefetcher = Prefetcher(items(), 2)
+        for item in prefetcher:
+            if item == 5:
+                break
+        prefetcher.close()
+        self.assertTrue(closed.is_set())
+        self.assertFalse(prefetcher._thread.is_alive())
+
+    def test_timed_iterator(self):
+        timed = TimedIterator(range(10))
+        self.assertEqual(list(timed), list(range(10)))
+        self.assertEqual(timed.wait_seconds, timed.producer_seconds)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,248 @@
+import io
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import text
+
+from mply_ingester.config import ConfigBroker
+from mply_ingester.db.models import Client, ClientProduct, IngestionCheckpoint
+from mply_ingester.ingestion.base import CellError, ParserConfig, RejectedRow, RejectedRows
+from mply_ingester.ingestion.dedup import find_previous_ingest, record_ingest, reserve_idempotency_key
+from mply_ingester.ingestion.service import DataIngestionService
+from mply_ingester.tests.test_utils.base import DBTestCase
+
+PARSER_CONFIG = ParserConfig(parser_id="csv", column_mapping={
+    "sku": ("sku", "text"),
+    "title": ("title", "text"),
+})
+PRICE_MAPPING = {
+    "sku": ("sku", "text"),
+    "price": ("reference_price", "decimal"),
+}
+
+
+class UnseekableReader(io.RawIOBase):
+    def __init__(self, data):
+        self._source = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self._source.readinto(buffer)
+
+
+class InterruptedReader(UnseekableReader):
+    """Reads data, but fails like a dropped connection once fail_after bytes have been read"""
+
+    def __init__(self, data, fail_after):
+        super().__init__(data)
+        self.fail_after = fail_after
+
+    def readinto(self, buffer):
+        if self._source.tell() >= self.fail_after:
+            raise OSError("Connection reset")
+        return super().readinto(memoryview(buffer)[:self.fail_after - self._source.tell()])
+
+
+class ChunkedCommitTestCase(DBTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as f:
+            f.write("INGEST_COMMIT_EVERY = 25\nINGEST_BATCH_SIZE = 10\nINGEST_COPY_THRESHOLD = None\n")
+        try:
+            cls.chunked_config_broker = ConfigBroker([f.name])
+        finally:
+            os.unlink(f.name)
+        client = Client(company_name="ChunkCo", address="1 Chunk Rd", active=True)
+        cls.session.add(client)
+        cls.session.commit()
+        cls.client_id = client.id
+
+    def setUp(self):
+        super().setUp()
+        self.session.execute(text("TRUNCATE TABLE client_products, ingestion_checkpoints, ingestion_uploads"))
+        self.session.commit()
+        self.data = b"sku,title\n" + b"".join(f"SKU{i:04d},Product {i:04d}\n".encode() for i in range(1000))
+
+    def ingest(self, client_data, full_update=False, upload_hash="a" * 64, parser_config=PARSER_CONFIG):
+        session = self.chunked_config_broker.get_session()
+        try:
+            service = DataIngestionService(self.chunked_config_broker, session, session.get(Client, self.client_id))
+            return service.ingest_data(parser_config, client_data, full_update=full_update, upload_hash=upload_hash)
+        finally:
+            session.close()
+
+    def interrupted(self):
+        return io.BufferedReader(InterruptedReader(self.data, len(self.data) // 2))
+
+    def product_count(self, **filters):
+        self.refresh_session()
+        return self.session.query(ClientProduct).filter_by(client_id=self.client_id, **filters).count()
+
+    def test_failure_keeps_committed_chunks_and_resumes(self):
+        report = self.ingest(self.interrupted())
+        self.assertFalse(report.success)
+        committed = report.processed_items
+        self.assertGreater(committed, 0)
+        self.assertEqual(committed % 25, 0)
+        self.assertEqual(self.product_count(), committed)
+        self.assertEqual(self.session.query(IngestionCheckpoint).one().rows_committed, committed)
+
+        report = self.ingest(self.data)
+        self.assertTrue(report.success, report.message)
+        self.assertEqual(report.processed_items, 1000)
+        self.assertEqual(report.stats["resumed_count"], committed)
+        self.assertEqual(report.stats["created_count"], 1000 - committed)
+        self.assertEqual(self.product_count(), 1000)
+        self.assertEqual(self.session.query(IngestionCheckpoint).count(), 0)
+
+    def test_full_update_deactivates_after_the_last_chunk(self):
+        self.session.add(ClientProduct(client_id=self.client_id, sku="OLD", active=True))
+        self.session.commit()
+
+        self.assertFalse(self.ingest(self.interrupted(), full_update=True).success)
+        self.assertEqual(self.product_count(sku="OLD", active=True), 1)
+
+        report = self.ingest(self.data, full_update=True)
+        self.assertTrue(report.success, report.message)
+        self.assertGreater(report.stats["resumed_count"], 0)
+        self.assertEqual(report.stats["deactivated_count"], 1)
+        # The SKUs of the rows skipped on resume still count as ingested
+        self.assertEqual(report.stats["total_ingested_skus"], 1000)
+        self.assertEqual(self.product_count(active=True), 1000)
+
+    def test_other_ingest_in_between_prevents_resume(self):
+        self.assertFalse(self.ingest(self.interrupted()).success)
+        self.assertTrue(self.ingest(b"sku,title\nSKU0000,Renamed\n", upload_hash="b" * 64).success)
+
+        report = self.ingest(self.data)
+        self.assertTrue(report.success, report.message)
+        self.assertEqual(report.stats["resumed_count"], 0)
+        self.refresh_session()
+        self.assertEqual(self.session.query(ClientProduct).filter_by(sku="SKU0000").one().title, "Product 0000")
+
+    def test_failure_after_commits_stops_replays(self):
+        small = b"sku,title\nSKU0000,Small\n"
+        report = self.ingest(small, upload_hash="b" * 64)
+        record_ingest(self.chunked_config_broker, self.session, self.client_id, "b" * 64, "feed-1", report)
+        self.assertIsNotNone(find_previous_ingest(self.chunked_config_broker, self.session, self.client_id, "b" * 64))
+
+        # Commits chunks that overwrite SKU0000 before it fails
+        self.assertFalse(self.ingest(self.interrupted()).success)
+        self.refresh_session()
+        self.assertIsNone(find_previous_ingest(self.chunked_config_broker, self.session, self.client_id, "b" * 64))
+        # The key is free again, reserving it replays nothing
+        self.assertIsNone(reserve_idempotency_key(self.chunked_config_broker, self.session, self.client_id, "b" * 64,
+                                                  "feed-1"))
+
+    def test_failure_without_commits_keeps_replays(self):
+        report = self.ingest(b"sku,title\nSKU0000,Small\n", upload_hash="b" * 64)
+        record_ingest(self.chunked_config_broker, self.session, self.client_id, "b" * 64, None, report)
+
+        data = io.BufferedReader(InterruptedReader(self.data, 10))
+        self.assertFalse(self.ingest(data).success)
+        self.refresh_session()
+        self.assertIsNotNone(find_previous_ingest(self.chunked_config_broker, self.session, self.client_id, "b" * 64))
+
+    def with_bad_rows(self, every):
+        lines = [f"SKU{i:04d},{'x' if i % every == every - 1 else i}\n" for i in range(1000)]
+        return ("sku,price\n" + "".join(lines)).encode()
+
+    def test_error_budget_percentage_is_checked_before_the_first_commit(self):
+        # Bad rows after the first chunks: every 100th row, 10 in all
+        for error_budget in ("0%", "0.5%"):
+            for seekable in (True, False):
+                with self.subTest(error_budget=error_budget, seekable=seekable):
+                    data = self.with_bad_rows(100)
+                    if not seekable:
+                        data = io.BufferedReader(UnseekableReader(data))
+                    report = self.ingest(data, parser_config=ParserConfig(
+                        parser_id="csv", column_mapping=PRICE_MAPPING, error_budget=error_budget
+                    ))
+                    self.assertFalse(report.success)
+                    self.assertEqual(report.processed_items, 0)
+                    self.assertIn("row 100, column 'price'", report.message.lower())
+                    self.assertEqual(self.product_count(), 0)
+                    self.assertEqual(self.session.query(IngestionCheckpoint).count(), 0)
+
+    def test_error_budget_count_is_checked_as_the_rows_come(self):
+        # Accepted rows before the one over the budget: 99 before row 100, and 594 before row 600
+        for error_budget, committed in ((None, 75), (5, 575)):
+            with self.subTest(error_budget=error_budget):
+                self.session.execute(text("TRUNCATE TABLE client_products, ingestion_checkpoints"))
+                self.session.commit()
+                report = self.ingest(self.with_bad_rows(100), parser_config=ParserConfig(
+                    parser_id="csv", column_mapping=PRICE_MAPPING, error_budget=error_budget
+                ))
+                self.assertFalse(report.success)
+                self.assertIn("row 100, column 'price'", report.message.lower())
+                self.assertIn(f"{committed} products were committed before the error", report.message)
+                self.assertEqual(report.processed_items, committed)
+                self.assertEqual(self.product_count(), committed)
+
+    def test_rows_within_the_error_budget_are_reported_once(self):
+        report = self.ingest(self.with_bad_rows(100), parser_config=ParserConfig(
+            parser_id="csv", column_mapping=PRICE_MAPPING, error_budget="1%"
+        ))
+        self.assertTrue(report.success, report.message)
+        self.assertEqual(report.stats["rejected_count"], 10)
+        self.assertEqual([error["row"] for error in report.report], list(range(100, 1001, 100)))
+        self.assertEqual(self.product_count(), 990)
+
+
+class WriterErrorBudgetTestCase(DBTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.config_brokers = {}
+        for writer, copy_threshold in (("bulk", None), ("copy", 5)):
+            with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as f:
+                f.write(f"INGEST_WRITER = 'bulk'\nINGEST_BATCH_SIZE = 10\nINGEST_COPY_THRESHOLD = {copy_threshold}\n")
+            try:
+                cls.config_brokers[writer] = ConfigBroker([f.name])
+            finally:
+                os.unlink(f.name)
+        client = Client(company_name="BudgetCo", address="1 Budget Rd", active=True)
+        cls.session.add(client)
+        cls.session.commit()
+        cls.client_id = client.id
+
+    def test_over_the_error_budget_while_writing(self):
+        # The budget runs out at row 600, long after the COPY writer has started feeding COPY
+        lines = [f"SKU{i:04d},{'x' if i % 100 == 99 else i}\n" for i in range(1000)]
+        data = ("sku,price\n" + "".join(lines)).encode()
+        parser_config = ParserConfig(parser_id="csv", column_mapping=PRICE_MAPPING, error_budget=5)
+        messages = {}
+        for writer, config_broker in self.config_brokers.items():
+            with self.subTest(writer=writer):
+                session = config_broker.get_session()
+                try:
+                    service = DataIngestionService(config_broker, session, session.get(Client, self.client_id))
+                    report = service.ingest_data(parser_config, data)
+                finally:
+                    session.close()
+                self.assertFalse(report.success)
+                messages[writer] = report.message
+                self.refresh_session()
+                self.assertEqual(self.session.query(ClientProduct).filter_by(client_id=self.client_id).count(), 0)
+        self.assertEqual(messages["copy"], messages["bulk"])
+        self.assertIn("6 rows rejected, over the error budget of 5", messages["copy"])
+
+
+class RejectedRowsTestCase(unittest.TestCase):
+    def test_over_budget_without_reported_errors(self):
+        for error_budget, message in ((0, "Row 3, column 'price': bad"),
+                                      (1, "2 rows rejected, over the error budget of 1. First at row 3")):
+            with self.subTest(error_budget=error_budget):
+                rejected = RejectedRows(error_budget, max_reported=0)
+                with self.assertRaisesRegex(ValueError, message):
+                    rejected.add(3, RejectedRow([CellError("price", "x", "bad")]))
+                    rejected.add(5, RejectedRow([CellError("price", "y", "bad")]))
+                self.assertEqual(rejected.reported, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import bz2
+import gzip
+import io
+import lzma
+import unittest
+import zipfile
+
+from mply_ingester.ingestion.streams import UploadTooLargeError, decompress, limit_size
+
+
+class ForwardOnlyReader(io.RawIOBase):
+    """Can only be read forward, like a network stream"""
+
+    def __init__(self, data):
+        self._source = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self._source.readinto(buffer)
+
+
+class LimitSizeTestCase(unittest.TestCase):
+    def test_reads_within_limit(self):
+        stream = limit_size(io.BytesIO(b"x" * 100), 100)
+        self.assertEqual(stream.read(), b"x" * 100)
+
+    def test_raises_once_over_limit(self):
+        stream = limit_size(io.BytesIO(b"x" * 101), 100)
+        with self.assertRaises(UploadTooLargeError):
+            stream.read()
+
+    def test_no_limit(self):
+        stream = limit_size(io.BytesIO(b"x" * 100), None)
+        self.assertEqual(len(stream.read()), 100)
+
+
+    def test_names_the_stream_in_the_error(self):
+        stream = limit_size(io.BytesIO(b"x" * 101), 100, "Decompressed upload")
+        with self.assertRaisesRegex(UploadTooLargeError, "^Decompressed upload exceeds"):
+            stream.read()
+
+    def test_rewinding_does_not_count_twice(self):
+        stream = limit_size(io.BytesIO(b"x" * 100), 100)
+        self.assertTrue(stream.seekable())
+        self.assertEqual(stream.read(), b"x" * 100)
+        stream.seek(0)
+        self.assertEqual(stream.read(), b"x" * 100)
+        self.assertFalse(limit_size(ForwardOnlyReader(b"x"), 100).seekable())
+
+
+def zip_archive(members):
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return output.getvalue()
+
+
+class DecompressTestCase(unittest.TestCase):
+    data = b"sku,title\n" + b"".join(b"SKU%d,Product %d\n" % (i, i) for i in range(1000))
+
+    def sources(self, data):
+        # A seekable file, and a stream that can only be read forward like an upload
+        return {"seekable": io.BytesIO(data), "stream": limit_size(ForwardOnlyReader(data), None)}
+
+    def test_compressed_formats(self):
+        compressed = {
+            "gzip": gzip.compress(self.data),
+            "bz2": bz2.compress(self.data),
+            "xz": lzma.compress(self.data),
+            "zip": zip_archive({"products.csv": self.data}),
+        }
+        for name, data in compressed.items():
+            for source_name, source in self.sources(data).items():
+                with self.subTest(format=name, source=source_name):
+                    stream, was_compressed = decompress(source)
+                    self.assertTrue(was_compressed)
+                    self.assertEqual(stream.read(), self.data)
+
+    def test_uncompressed_data_is_unchanged(self):
+        for data in (self.data, b"", b"P"):
+            for source_name, source in self.sources(data).items():
+                with self.subTest(data=data[:10], source=source_name):
+                    stream, was_compressed = decompress(source)
+                    self.assertFalse(was_compressed)
+                    self.assertEqual(stream.read(), data)
+
+    def test_zip_must_have_a_single_file(self):
+        data = zip_archive({"a.csv": self.data, "b.csv": self.data})
+        with self.assertRaisesRegex(ValueError, "single file"):
+            decompress(io.BytesIO(data))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+from decimal import Decimal
+
+from mply_ingester.ingestion.transformers import (
+    BaseTransformer, BooleanTransformer, DecimalTransformer, IntegerTransformer, TextTransformer, TransformerError
+)
+
+
+class UpperTransformer(BaseTransformer):
+    def transform(self, value):
+        return str(value).upper()
+
+
+class TransformManyTestCase(unittest.TestCase):
+    def assertTransformManyMatches(self, transformer, values):
+        self.assertEqual(transformer.transform_many(values), [transformer.transform(value) for value in values])
+
+    def test_decimal(self):
+        values = ["$1,234.50", " £3 ", "12.99", 7, 2.5, None]
+        self.assertTransformManyMatches(DecimalTransformer(), values)
+        self.assertEqual(DecimalTransformer().transform_many(["$1,234.50"]), [Decimal("1234.50")])
+
+    def test_integer(self):
+        self.assertTransformManyMatches(IntegerTransformer(), ["1", " 2 ", "3"])
+        self.assertTransformManyMatches(IntegerTransformer(), ["1", "2.7", "abc", 4.2, None])
+
+    def test_boolean(self):
+        self.assertTransformManyMatches(BooleanTransformer(), ["yes", " TRUE ", "0", "No", True, 0])
+        with self.assertRaises(TransformerError):
+            BooleanTransformer().transform_many(["yes", "maybe"])
+
+    def test_text(self):
+        self.assertTransformManyMatches(TextTransformer(), [" a ", "b", 3, None])
+
+    def test_default_calls_transform(self):
+        self.assertEqual(UpperTransformer().transform_many(["a", "b"]), ["A", "B"])
+
+
+if __name__ == "__main__":
+    unittest.main()
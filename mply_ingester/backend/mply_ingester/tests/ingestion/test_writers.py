@@ -0,0 +1,213 @@
+import unittest
+from decimal import Decimal
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from mply_ingester.db.models import Client, ClientProduct
+from mply_ingester.tests.test_utils.base import DBTestCase
+
+
+class ProductWriterTestCase(DBTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        client = Client(company_name="WriterCo", address="1 Writer Rd", active=True)
+        cls.session.add(client)
+        cls.session.commit()
+        cls.client_id = client.id
+
+    def setUp(self):
+        super().setUp()
+        self.session.execute(text("TRUNCATE TABLE client_products"))
+        self.session.commit()
+        self.client = self.session.get(Client, self.client_id)
+
+    def upsert(self, writer_id, records):
+        return self.write(writer_id, records).processed_count
+
+    def write(self, writer_id, records, full_update=False):
+        writer = self.config_broker.get_writer(writer_id, self.session, self.client)
+        result = writer.write(iter(records), full_update)
+        self.session.commit()
+        return result
+
+    def products_by_sku(self):
+        products = self.session.query(ClientProduct).filter_by(client_id=self.client_id).all()
+        return {p.sku: (p.title, p.brand, p.active, p.reference_price) for p in products}
+
+    def test_writers_produce_the_same_result(self):
+        initial = [
+            {"sku": "A", "title": "A", "brand": "Acme", "active": True, "reference_price": Decimal("1.50")},
+            {"sku": "B", "title": "B", "brand": "Acme", "active": True, "reference_price": Decimal("2.00")},
+        ]
+        update = [
+            {"sku": "A", "title": "A2", "brand": None, "active": False, "reference_price": None},
+            {"sku": "C", "title": "C", "brand": None, "active": True, "reference_price": Decimal("3")},
+            {"sku": "C", "title": "C2", "brand": "Other", "active": True, "reference_price": None},
+            {},
+        ]
+
+        results = {}
+        for writer_id in ("row", "bulk", "copy"):
+            with self.subTest(writer_id=writer_id):
+                self.session.execute(text("TRUNCATE TABLE client_products"))
+                self.assertEqual(self.upsert(writer_id, initial), 2)
+                self.assertEqual(self.upsert(writer_id, update), 3)
+                results[writer_id] = self.products_by_sku()
+
+        self.assertEqual(results["row"], results["bulk"])
+        self.assertEqual(results["row"], results["copy"])
+        self.assertEqual(results["bulk"], {
+            "A": ("A2", "Acme", False, Decimal("1.50")),
+            "B": ("B", "Acme", True, Decimal("2.00")),
+            "C": ("C2", "Other", True, Decimal("3.00")),
+        })
+
+    def test_writers_full_update(self):
+        initial = [
+            {"sku": "A", "title": "A", "active": True},
+            {"sku": "B", "title": "B", "active": True},
+            {"sku": "", "title": "No SKU", "active": True},
+        ]
+        full_update = [
+            {"sku": "A", "title": "A2", "active": True},
+            {"sku": "", "title": "Another without SKU", "active": True},
+        ]
+
+        for writer_id in ("row", "bulk", "copy"):
+            with self.subTest(writer_id=writer_id):
+                self.session.execute(text("TRUNCATE TABLE client_products"))
+                self.write(writer_id, initial)
+                result = self.write(writer_id, full_update, full_update=True)
+                self.assertEqual(result.processed_count, 2)
+                self.assertEqual(result.deactivated_count, 2)
+                self.assertEqual(result.ingested_sku_count, 1)
+
+                products = self.session.query(ClientProduct).filter_by(client_id=self.client_id).all()
+                active_titles = sorted(p.title for p in products if p.active)
+                self.assertEqual(active_titles, ["A2", "Another without SKU"])
+
+    def test_full_update_leaves_inactive_products_alone(self):
+        stamp = "2000-01-01 00:00:00"
+        records = [{"sku": f"SKU{i}", "title": f"Product {i}"} for i in range(self.config_broker['INGEST_BATCH_SIZE'] + 5)]
+
+        for writer_id in ("row", "bulk", "copy"):
+            with self.subTest(writer_id=writer_id):
+                self.session.execute(text("TRUNCATE TABLE client_products"))
+                self.write(writer_id, [{"sku": "GONE", "active": True}, {"sku": "OFF", "active": False}])
+                self.session.execute(text("UPDATE client_products SET last_changed_on = :stamp"), {"stamp": stamp})
+                self.session.commit()
+
+                result = self.write(writer_id, records, full_update=True)
+                self.assertEqual(result.deactivated_count, 1)
+                self.assertEqual(result.ingested_sku_count, len(records))
+
+                products = self.session.query(ClientProduct).filter(ClientProduct.sku.in_(["GONE", "OFF"])).all()
+                self.assertEqual({p.sku: p.active for p in products}, {"GONE": False, "OFF": False})
+                changed = {p.sku: p.last_changed_on.year != 2000 for p in products}
+                self.assertEqual(changed, {"GONE": True, "OFF": False})
+
+    def test_writers_skip_unchanged_products(self):
+        initial = [
+            {"sku": "A", "title": "A", "brand": "Acme", "reference_price": Decimal("1.50")},
+            {"sku": "B", "title": "B", "brand": "Acme", "reference_price": Decimal("2.00")},
+            {"sku": "C", "title": "C", "brand": "Acme", "reference_price": Decimal("3.00")},
+        ]
+        resend = [
+            {"sku": "A", "title": "A", "brand": None, "reference_price": Decimal("1.5")},
+            {"sku": "B", "title": "B2", "brand": "Acme", "reference_price": Decimal("2.00")},
+            {"sku": "C", "title": "C", "brand": "Acme", "reference_price": Decimal("3.00")},
+            {"sku": "D", "title": "D", "brand": None, "reference_price": None},
+        ]
+        stamp = "2000-01-01 00:00:00"
+
+        for writer_id in ("row", "bulk", "copy"):
+            with self.subTest(writer_id=writer_id):
+                self.session.execute(text("TRUNCATE TABLE client_products"))
+                result = self.write(writer_id, initial)
+                self.assertEqual((result.created_count, result.updated_count, result.unchanged_count), (3, 0, 0))
+                self.session.execute(text("UPDATE client_products SET last_changed_on = :stamp"), {"stamp": stamp})
+                self.session.commit()
+
+                result = self.write(writer_id, resend)
+                self.assertEqual(result.processed_count, 4)
+                self.assertEqual((result.created_count, result.updated_count, result.unchanged_count), (1, 1, 2))
+
+                unchanged = self.session.execute(text(
+                    "SELECT sku FROM client_products WHERE last_changed_on = :stamp ORDER BY sku"
+                ), {"stamp": stamp}).scalars().all()
+                self.assertEqual(unchanged, ["A", "C"])
+                self.assertEqual(self.products_by_sku()["B"][0], "B2")
+
+    def test_copy_writer_diff_matches_the_write(self):
+        self.write("copy", [
+            {"sku": "A", "title": "A", "brand": "Acme", "reference_price": Decimal("1.50")},
+            {"sku": "B", "title": "B", "brand": "Acme"},
+            {"sku": "GONE", "title": "Gone"},
+            {"sku": "OFF", "title": "Off", "active": False},
+        ])
+        records = [
+            {"sku": "A", "title": "A2", "brand": None, "reference_price": Decimal("1.5")},
+            {"sku": "B", "title": "B", "brand": "Acme"},
+            {"sku": "C", "title": "C"},
+            {"sku": "C", "title": "C2"},
+            {"sku": "", "title": "No SKU"},
+        ]
+        before = self.products_by_sku()
+
+        writer = self.config_broker.get_writer("copy", self.session, self.client)
+        result, details = writer.diff(iter(records), full_update=True, sample_size=10)
+        self.session.rollback()
+        self.assertEqual(self.products_by_sku(), before)
+
+        self.assertEqual(details["changed_columns"], {"title": 1})
+        self.assertEqual(details["sample"], {
+            "created": [{"sku": "C", "title": "C2"}],
+            "updated": [{"sku": "A", "changes": {"title": {"old": "A", "new": "A2"}}}],
+            "deactivated": [{"sku": "GONE", "title": "Gone"}],
+        })
+        written = self.write("copy", records, full_update=True)
+        for count in ("processed_count", "created_count", "updated_count", "unchanged_count", "deactivated_count",
+                      "ingested_sku_count"):
+            self.assertEqual(getattr(result, count), getattr(written, count), count)
+
+    def test_copy_writer_escapes_values(self):
+        title = "Tab\there, new\nline and a back\\slash \\N"
+        self.upsert("copy", [{"sku": "ESC", "title": title, "brand": None}])
+        product = self.session.query(ClientProduct).filter_by(sku="ESC").one()
+        self.assertEqual(product.title, title)
+        self.assertIsNone(product.brand)
+        self.assertTrue(product.active)
+
+    def test_bulk_writer_spans_batches(self):
+        batch_size = self.config_broker['INGEST_BATCH_SIZE']
+        records = [{"sku": f"SKU{i}", "title": f"Product {i}"} for i in range(batch_size + 10)]
+        records.append({"sku": "SKU0", "title": "Updated in a later batch"})
+
+        self.assertEqual(self.upsert("bulk", records), batch_size + 11)
+
+        products = self.products_by_sku()
+        self.assertEqual(len(products), batch_size + 10)
+        self.assertEqual(products["SKU0"][0], "Updated in a later batch")
+
+    def test_sku_is_unique_per_client(self):
+        other_client = Client(company_name="OtherCo", address="2 Writer Rd", active=True)
+        self.session.add(other_client)
+        self.session.flush()
+        self.session.add_all([
+            ClientProduct(client_id=self.client_id, sku="A"),
+            ClientProduct(client_id=other_client.id, sku="A"),
+            ClientProduct(client_id=self.client_id, sku=""),
+            ClientProduct(client_id=self.client_id, sku=""),
+        ])
+        self.session.commit()
+
+        self.session.add(ClientProduct(client_id=self.client_id, sku="A"))
+        with self.assertRaises(IntegrityError):
+            self.session.commit()
+        self.session.rollback()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import gc
+import unittest
+
+from mply_ingester.config import ConfigBroker, ConfigError, DuplicateIdError
+from mply_ingester.ingestion.parsers import CSVParser
+from mply_ingester.ingestion.transformers import TextTransformer
+
+
+class UpperTextTransformer(TextTransformer):
+    """A subclass of a subclass, which BaseTransformer.__subclasses__() alone does not list"""
+
+    id = 'upper_text'
+
+    def transform(self, value):
+        return super().transform(value).upper()
+
+
+class InheritedIdTransformer(TextTransformer):
+    """Inherits the 'text' id instead of declaring one, so it is not registered"""
+
+
+class ConfigBrokerRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.config_broker = ConfigBroker([])
+
+    def test_transformers_are_shared(self):
+        transformer = self.config_broker.get_transformer('text')
+        self.assertIs(type(transformer), TextTransformer)
+        self.assertIs(self.config_broker.get_transformer('text'), transformer)
+
+    def test_parsers_are_shared(self):
+        parser = self.config_broker.get_parser('csv')
+        self.assertIsInstance(parser, CSVParser)
+        self.assertIs(self.config_broker.get_parser('csv'), parser)
+
+    def test_nested_subclasses_are_registered(self):
+        self.assertEqual(self.config_broker.get_transformer('upper_text').transform(' abc '), 'ABC')
+
+    def test_unknown_ids(self):
+        with self.assertRaises(ValueError):
+            self.config_broker.get_transformer('nope')
+        with self.assertRaises(ValueError):
+            self.config_broker.get_parser('nope')
+
+    def test_explicit_registration(self):
+        self.config_broker.get_transformer('text')  # Build the registry first
+
+        class ReversedTextTransformer(TextTransformer):
+            id = 'reversed_text_test'
+
+            def transform(self, value):
+                return super().transform(value)[::-1]
+
+        self.config_broker.register_transformer(ReversedTextTransformer)
+        self.assertEqual(self.config_broker.get_transformer('reversed_text_test').transform('abc'), 'cba')
+
+        with self.assertRaises(ConfigError):
+            self.config_broker.register_transformer(CSVParser)
+
+    def test_duplicate_ids_raise(self):
+        self.config_broker.get_transformer('text')
+
+        class DuplicateTextTransformer(TextTransformer):
+            id = 'text'
+
+        try:
+            with self.assertRaisesRegex(DuplicateIdError, "Duplicate transformer id 'text'"):
+                self.config_broker.register_transformer(DuplicateTextTransformer)
+            with self.assertRaises(DuplicateIdError):
+                ConfigBroker([]).get_transformer('text')
+        finally:
+            # Classes stay listed in __subclasses__ until collected, don't leak this one into other tests
+            del DuplicateTextTransformer
+            gc.collect()
+
+
+if __name__ == "__main__":
+    unittest.main()
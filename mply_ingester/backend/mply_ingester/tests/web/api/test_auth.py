@@ -1,10 +1,14 @@
 import logging
+import time
 import unittest
 import bcrypt
 
 from fastapi.testclient import TestClient
+from sqlalchemy import event, select, update
 
+from mply_ingester.db.models import User
 from mply_ingester.web.app import make_app
+from mply_ingester.web.session_cache import CachedSession, SessionTokenCache
 from mply_ingester.tests.test_utils.base import DBTestCase
 
 
@@ -82,5 +86,88 @@ class LoginLogoutTestCase(AuthApiTestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertIn("Successfully logged out", resp.text)
 
+class SessionCacheTestCase(AuthApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.post("/auth/signup", data=self.signup_data)
+        # test_deactivation_forgets_the_token leaves the user inactive
+        self.session.execute(update(User).where(User.email == self.signup_data["email"]).values(active=True))
+        self.session.commit()
+        self.client.post("/auth/login", data=self.login_data)
+        self.token = self.client.cookies["session_token"]
+
+    def list_products(self, token):
+        # As a header, the cookie jar of the client would override a cookies argument
+        return self.client.get("/products/list", headers={"Cookie": f"session_token={token}"})
+
+    def test_cached_token_needs_no_user_query(self):
+        self.assertEqual(self.list_products(self.token).status_code, 200)
+
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        engine = self.config_broker.get_session().get_bind()
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            self.assertEqual(self.list_products(self.token).status_code, 200)
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        self.assertEqual([s for s in statements if "FROM users" in s or "FROM clients" in s], [])
+
+    def test_logout_forgets_the_token(self):
+        self.assertEqual(self.list_products(self.token).status_code, 200)
+        self.assertEqual(self.client.post("/auth/logout").status_code, 200)
+        self.assertEqual(self.list_products(self.token).status_code, 401)
+
+    def test_login_again_forgets_the_previous_token(self):
+        self.assertEqual(self.list_products(self.token).status_code, 200)
+        self.client.post("/auth/login", data=self.login_data)
+        self.assertEqual(self.list_products(self.token).status_code, 401)
+        self.assertEqual(self.list_products(self.client.cookies["session_token"]).status_code, 200)
+
+    def test_deactivation_forgets_the_token(self):
+        self.assertEqual(self.list_products(self.token).status_code, 200)
+        user = self.session.scalar(select(User).where(User.email == self.signup_data["email"]))
+        user.active = False
+        self.session.commit()
+        self.assertEqual(self.list_products(self.token).status_code, 401)
+
+    def test_rollback_discards_the_changed_accounts(self):
+        user = self.session.scalar(select(User).where(User.email == self.signup_data["email"]))
+        user.full_name = "Renamed"
+        self.session.flush()
+        self.assertEqual(self.session.info["changed_user_ids"], {user.id})
+        self.session.rollback()
+        self.assertNotIn("changed_user_ids", self.session.info)
+
+
+class SessionTokenCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = SessionTokenCache(max_size=2, ttl=60)
+
+    def test_least_recently_used_is_evicted(self):
+        for i, token in enumerate("abc"):
+            if token == "c":
+                self.cache.get("a")
+            self.cache.put(token, CachedSession(i, i, True, True), self.cache.generation)
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIsNotNone(self.cache.get("c"))
+
+    def test_entries_expire(self):
+        self.cache.ttl = 0.01
+        self.cache.put("a", CachedSession(1, 1, True, True), self.cache.generation)
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_forget_drops_lookups_made_before(self):
+        self.cache.put("a", CachedSession(1, 10, True, True), self.cache.generation)
+        generation = self.cache.generation
+        self.cache.forget(client_ids={10})
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.put("a", CachedSession(1, 10, True, True), generation)
+        self.assertIsNone(self.cache.get("a"))
+
+
 if __name__ == "__main__":
     unittest.main()
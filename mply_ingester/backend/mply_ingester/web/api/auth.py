@@ -31,7 +31,7 @@ class SignupResponse(BaseModel):
 
 
 @router.post("/login", response_model=LoginResponse)
-async def login(
+def login(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
     response: Response,
     db: Session = Depends(get_db_session),
@@ -75,7 +75,7 @@ async def login(
 
 
 @router.post("/logout")
-async def logout(
+def logout(
     current_user: LoggedInUser,
     db: DbSession,
     response: Response
@@ -95,7 +95,7 @@ async def logout(
 
 
 @router.post("/signup")
-async def signup(
+def signup(
     full_name: Annotated[str, Form(min_length=3, max_length=50)],
     email: Annotated[EmailStr, Form()],
     password: Annotated[SecretStr, Form(min_length=8)],
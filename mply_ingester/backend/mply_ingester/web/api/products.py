@@ -1,15 +1,24 @@
-from fastapi import APIRouter, Depends, Form, HTTPException, Query, UploadFile, File, Body
+from fastapi import APIRouter, Depends, Form, Header, HTTPException, Query, Response, UploadFile, File, Body
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from mply_ingester.config import ConfigBroker
 from sqlalchemy.orm import Session
-from typing import Annotated, List, Optional
+from typing import Annotated, List, Literal, Optional, Union
 
-from sqlalchemy import or_, case, func
+from sqlalchemy import tuple_
 
-from mply_ingester.web.dependencies import DbSession, LoggedInClient, LoggedInUser, get_db_session
-from mply_ingester.db.models import ClientProduct
+from mply_ingester.web.dependencies import DbSession, IngestionExecutor, JobRunner, LoggedInClient, LoggedInUser, ProductSearcher, get_db_session
+from mply_ingester.db.models import ClientProduct, IngestionJob
 from mply_ingester.ingestion.base import ParserConfig, IngestionReport
+from mply_ingester.ingestion.dedup import (
+    IdempotencyKeyInProgressError, IdempotencyKeyReusedError, find_previous_ingest, hash_upload, record_ingest,
+    release_idempotency_key, reserve_idempotency_key
+)
 from mply_ingester.ingestion.service import DataIngestionService
-from pydantic import BaseModel
+from mply_ingester.ingestion.streams import UploadTooLargeError, limit_size
+from mply_ingester.web.export import FORMATS as EXPORT_FORMATS, export_products
+from mply_ingester.web.search import LISTING_KEYS, InvalidCursorError, decode_cursor, encode_cursor
+from pydantic import BaseModel, ConfigDict
 from datetime import datetime
 
 router = APIRouter()
@@ -32,66 +41,197 @@ class ClientProductOut(BaseModel):
         orm_mode = True
 
 @router.get("/list", response_model=List[ClientProductOut])
-async def list_client_products(
+def list_client_products(
     db: DbSession,
     current_user: LoggedInUser,
+    product_search: ProductSearcher,
+    response: Response,
     s: Annotated[int, Query(ge=0, title="Offset")] = 0,
     l: Annotated[int, Query(ge=1, le=50, title= "Limit")] = 5,
-    q: Annotated[str, Query(title="Search query")] = None
+    q: Annotated[str, Query(title="Search query")] = None,
+    c: Annotated[str, Query(title="Cursor", description="The X-Next-Cursor of the previous page")] = None
 ):
-
+    """
+    Lists the client's products a page at a time. Full pages come with an X-Next-Cursor header, passing it as c
+    returns the page after it in constant time, however deep it is. The offset s still works, but gets slower
+    the deeper the page.
+    """
     offset = s
     limit = l
     query = db.query(ClientProduct).filter(ClientProduct.client_id == current_user.client_id)
 
     if q:
-        # Search in title, remote_id, and sku
-        search_filter = or_(
-            ClientProduct.title.ilike(f"%{q}%"),
-            ClientProduct.remote_id.ilike(f"%{q}%"),
-            ClientProduct.sku.ilike(f"%{q}%")
-        )
-        query = query.filter(search_filter)
-
-        # Order: exact sku matches first, then by how closely sku matches q, then by sku
-        exact_match_case = case(
-            (func.lower(ClientProduct.sku) == func.lower(q), 0),
-            else_=1
-        )
-        # For "closeness", order by whether sku startswith q, then by sku
-        startswith_case = case(
-            (ClientProduct.sku.ilike(f"{q}%"), 0),
-            else_=1
-        )
-        query = query.order_by(
-            exact_match_case,
-            startswith_case,
-            ClientProduct.sku
-        )
+        query = product_search.filter(query, q)
+        sort_keys = product_search.rank_keys(q)
     else:
-        query = query.order_by(ClientProduct.sku)
+        sort_keys = LISTING_KEYS
+
+    if c is not None:
+        try:
+            after = decode_cursor(c, sort_keys)
+        except InvalidCursorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        query = query.filter(tuple_(*sort_keys) > tuple_(*after))
+
+    rows = query.add_columns(*sort_keys).order_by(*sort_keys).offset(offset).limit(limit).all()
+    if len(rows) == limit:
+        response.headers['X-Next-Cursor'] = encode_cursor(rows[-1][1:])
+    return [row[0] for row in rows]
+
+@router.get("/export")
+def export_client_products(
+    current_user: LoggedInUser,
+    config_broker: ConfigBroker = Depends(),
+    format: Annotated[Literal['csv', 'ndjson'], Query(title="Export format")] = 'csv',
+    gzip: Annotated[bool, Query(title="Gzip the export")] = False
+):
+    """Streams all of the client's products, ordered by SKU, as CSV or newline delimited JSON"""
+    media_type, _ = EXPORT_FORMATS[format]
+    filename = f"products.{format}"
+    if gzip:
+        media_type = 'application/gzip'
+        filename += '.gz'
+    return StreamingResponse(
+        export_products(config_broker, current_user.client_id, format, gzip),
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+class IngestionJobOut(BaseModel):
+    id: int
+    status: str
+    full_update: bool
+    rows_parsed: int
+    rows_written: int
+    error_count: int
+    created_on: datetime
+    started_on: Optional[datetime]
+    finished_on: Optional[datetime]
+    report: Optional[IngestionReport]
 
-    products = query.offset(offset).limit(limit).all()
-    return products
+    model_config = ConfigDict(from_attributes=True)
 
-@router.post("/ingest", response_model=IngestionReport)
+@router.post("/ingest", response_model=Union[IngestionReport, IngestionJobOut])
 async def ingest_client_products(
     parser_config: Annotated[str, Form(...)],
     data_file: Annotated[UploadFile, File(...)],
     db: DbSession,
     current_client: LoggedInClient,
+    job_runner: JobRunner,
+    response: Response,
     config_broker: ConfigBroker = Depends(),
-    full_update: Annotated[bool, Body(description="Full update mode: any product ingested is active, any absent product is inactive")] = False
+    ingestion_executor: IngestionExecutor = Depends(),
+    full_update: Annotated[bool, Body(description="Full update mode: any product ingested is active, any absent product is inactive")] = False,
+    async_mode: Annotated[bool, Body(description="Queue the ingest as a background job and return the job instead of the report")] = False,
+    force: Annotated[bool, Body(description="Ingest even if the same upload was just ingested")] = False,
+    dry_run: Annotated[bool, Body(description="Report what the ingest would change, with a sample, without writing anything")] = False,
+    idempotency_key: Annotated[Optional[str], Header(alias="Idempotency-Key", max_length=255)] = None
 ):
+    """
+    Ingests the uploaded file. Sending again the upload of the client's latest ingest, or an Idempotency-Key
+    already sent with the same upload, returns the report of that ingest without ingesting anything, and sets the
+    Idempotent-Replayed header. force ingests the upload regardless. A request sent with the Idempotency-Key of an
+    ingest that is still running is rejected with 409.
+    A dry_run ingest is neither looked up nor remembered that way, and cannot run in async_mode.
+    """
     try:
         parser_config_obj = ParserConfig.model_validate_json(parser_config)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid parser_config: {e}")
-    # Read file content
-    file_bytes = await data_file.read()
-    # Ingest data
-    service = DataIngestionService(config_broker, db, current_client)
-    
-    report = service.ingest_data(parser_config_obj, file_bytes, full_update=full_update)
-    
-    return report
+    max_upload_size = config_broker['INGEST_MAX_UPLOAD_SIZE']
+    if max_upload_size is not None and data_file.size is not None and data_file.size > max_upload_size:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the maximum size of {max_upload_size} bytes")
+    if dry_run and async_mode:
+        raise HTTPException(status_code=400, detail="dry_run cannot be combined with async_mode")
+    # Hand the spooled upload to the parser as a stream instead of reading it into memory
+    client_data = limit_size(data_file.file, max_upload_size)
+
+    if dry_run:
+        service = DataIngestionService(config_broker, db, current_client)
+        try:
+            return await ingestion_executor.run(service.ingest_data, parser_config_obj, client_data,
+                                                full_update=full_update, dry_run=True)
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+
+    # Hashed through the size limit, an upload of unknown size is rejected before a key is reserved for it
+    try:
+        upload_hash = await run_in_threadpool(hash_upload, client_data, parser_config_obj, full_update)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    previous_report = None
+    if idempotency_key is not None:
+        try:
+            previous_report = await run_in_threadpool(
+                reserve_idempotency_key, config_broker, db, current_client.id, upload_hash, idempotency_key
+            )
+        except IdempotencyKeyReusedError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        except IdempotencyKeyInProgressError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    # Reserved unless a finished ingest was sent with the key, this ingest must then record or release it
+    reserved = idempotency_key is not None and previous_report is None
+    if not force and previous_report is None:
+        previous_report = await run_in_threadpool(
+            find_previous_ingest, config_broker, db, current_client.id, upload_hash
+        )
+        if previous_report is not None and reserved:
+            # The key replays the ingest that made this one redundant from now on
+            await run_in_threadpool(
+                record_ingest, config_broker, db, current_client.id, upload_hash, idempotency_key, previous_report
+            )
+    if previous_report is not None and not force:
+        response.headers['Idempotent-Replayed'] = 'true'
+        return previous_report
+
+    report = None
+    try:
+        if async_mode:
+            try:
+                job = await run_in_threadpool(
+                    job_runner.enqueue, db, current_client, parser_config_obj, data_file.file, full_update,
+                    upload_hash, idempotency_key
+                )
+            except UploadTooLargeError as e:
+                raise HTTPException(status_code=413, detail=str(e))
+            # The job records or releases the key once it has run
+            reserved = False
+            response.status_code = 202
+            return IngestionJobOut.model_validate(job)
+
+        service = DataIngestionService(config_broker, db, current_client)
+
+        try:
+            report = await ingestion_executor.run(service.ingest_data, parser_config_obj, client_data,
+                                                  full_update=full_update, upload_hash=upload_hash)
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+
+        if report.success:
+            await run_in_threadpool(
+                record_ingest, config_broker, db, current_client.id, upload_hash, idempotency_key, report
+            )
+        return report
+    finally:
+        if reserved and (report is None or not report.success):
+            await run_in_threadpool(release_idempotency_key, db, current_client.id, idempotency_key)
+
+def get_client_job(db: Session, client_id: int, job_id: int) -> IngestionJob:
+    job = db.query(IngestionJob).filter(
+        IngestionJob.id == job_id,
+        IngestionJob.client_id == client_id
+    ).one_or_none()
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    return job
+
+@router.get("/jobs/{job_id}", response_model=IngestionJobOut)
+def get_ingestion_job(job_id: int, db: DbSession, current_user: LoggedInUser):
+    return get_client_job(db, current_user.client_id, job_id)
+
+@router.get("/jobs/{job_id}/report", response_model=IngestionReport)
+def get_ingestion_job_report(job_id: int, db: DbSession, current_user: LoggedInUser):
+    job = get_client_job(db, current_user.client_id, job_id)
+    if job.report is None:
+        raise HTTPException(status_code=409, detail=f"Ingestion job is {job.status}")
+    return job.report
@@ -1,13 +1,35 @@
+from contextlib import asynccontextmanager
+
+from anyio import to_thread
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from mply_ingester.config import ConfigBroker
+from mply_ingester.ingestion.jobs import IngestionJobRunner
 from mply_ingester.web.api import auth, products
+from mply_ingester.web.dependencies import IngestionExecutor
+from mply_ingester.web.session_cache import SessionTokenCache
 
 def make_app(config_broker: ConfigBroker) -> FastAPI:
-    app = FastAPI(title="Client Data Ingester")
+    ingestion_executor = IngestionExecutor(config_broker['INGEST_MAX_CONCURRENCY'])
+    job_runner = IngestionJobRunner(config_broker)
+    session_cache = SessionTokenCache(config_broker['AUTH_CACHE_SIZE'], config_broker['AUTH_CACHE_TTL'])
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # Sync endpoints and dependencies run in anyio's default thread limiter
+        to_thread.current_default_thread_limiter().total_tokens = config_broker['WEB_THREADPOOL_SIZE']
+        job_runner.resume_queued()
+        yield
+        ingestion_executor.shutdown()
+        job_runner.shutdown()
+
+    app = FastAPI(title="Client Data Ingester", lifespan=lifespan)
+    app.state.job_runner = job_runner
+    app.state.session_cache = session_cache
 
     app.dependency_overrides[ConfigBroker] = lambda: config_broker
+    app.dependency_overrides[IngestionExecutor] = lambda: ingestion_executor
 
     # Configure CORS
     app.add_middleware(
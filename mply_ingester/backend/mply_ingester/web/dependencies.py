@@ -1,47 +1,112 @@
-from typing import Annotated, Generator
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Annotated, Any, Callable, Generator
 from fastapi import Depends, HTTPException, status, Cookie, Request
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.orm import Session, contains_eager, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 from mply_ingester.config import ConfigBroker
 from mply_ingester.db.models import User, Client
+from mply_ingester.ingestion.jobs import IngestionJobRunner
+from mply_ingester.web.search import ProductSearch, product_search_for
+from mply_ingester.web.session_cache import CachedSession, SessionTokenCache
 
 
-async def get_db_session(config_broker: ConfigBroker = Depends()) -> Generator[Session, None, None]:
+# The dependencies below block on the database, so they are plain functions that FastAPI runs in its threadpool
+# (sized by WEB_THREADPOOL_SIZE) instead of on the event loop.
+
+def get_db_session(config_broker: ConfigBroker = Depends()) -> Generator[Session, None, None]:
     db = config_broker.get_session()
     try:
         yield db
     finally:
         db.close()
 
-async def get_current_user(
+def get_session_token_cache(request: Request) -> SessionTokenCache:
+    # Kept on the app by make_app, like its IngestionJobRunner
+    return request.app.state.session_cache
+
+def _user_from_cache(db: Session, session_token: str, cached: CachedSession) -> User:
+    """
+    Attach the cached user and its client to db as if they had been loaded, without a query. Their other
+    attributes load on first access.
+    """
+    client = Client(id=cached.client_id, active=cached.client_active)
+    user = User(id=cached.user_id, client_id=cached.client_id, active=cached.user_active,
+                session_token=session_token)
+    make_transient_to_detached(client)
+    make_transient_to_detached(user)
+    # Not assigned through user.client, which would also fill client.users with just this user
+    set_committed_value(user, 'client', client)
+    db.add(user)
+    return user
+
+def get_current_user(
     request: Request,
     session_token: Annotated[str | None, Cookie()] = None,
-    db: Session = Depends(get_db_session)
+    db: Session = Depends(get_db_session),
+    session_cache: SessionTokenCache = Depends(get_session_token_cache)
 ) -> User:
     if not session_token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Not authenticated" + str(request.cookies)
         )
-    
-    user = db.query(User).filter(
+
+    cached = session_cache.get(session_token)
+    if cached is not None:
+        return _user_from_cache(db, session_token, cached)
+
+    generation = session_cache.generation
+    # The client is loaded along, get_current_client needs it
+    user = db.scalar(select(User).join(User.client).options(contains_eager(User.client)).where(
         User.session_token == session_token,
         User.active == True
-    ).first()
+    ))
     
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication token"
         )
-    
+
+    session_cache.put(session_token, CachedSession(user.id, user.client_id, user.active, user.client.active),
+                      generation)
     return user
 
-async def get_current_client(
+def get_product_search(db: Session = Depends(get_db_session)) -> ProductSearch:
+    return product_search_for(db)
+
+def get_current_client(
     current_user: Annotated[User, Depends(get_current_user)]
 ) -> Client:
+    # Loaded along with the user, or restored from the SessionTokenCache, so this needs no query either
     return current_user.client
 
+
+class IngestionExecutor:
+    """
+    Dedicated thread pool for ingestion, so that large uploads neither block the event loop nor use up the
+    threadpool that serves every other request. At most INGEST_MAX_CONCURRENCY ingests run at once, the rest queue.
+    """
+
+    def __init__(self, max_workers: int):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ingest')
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._pool, partial(func, *args, **kwargs))
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True)
+
+def get_job_runner(request: Request) -> IngestionJobRunner:
+    # Kept on the app by make_app, FastAPI cannot build an IngestionJobRunner from its ConfigBroker argument
+    return request.app.state.job_runner
+
 # Create type aliases for cleaner dependency injection
 LoggedInUser = Annotated[User, Depends(get_current_user)]
 LoggedInClient = Annotated[Client, Depends(get_current_client)]
 DbSession = Annotated[Session, Depends(get_db_session)]
+JobRunner = Annotated[IngestionJobRunner, Depends(get_job_runner)]
+ProductSearcher = Annotated[ProductSearch, Depends(get_product_search)]
@@ -0,0 +1,80 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Iterator, List, Sequence
+
+from sqlalchemy import select
+
+from mply_ingester.config import ConfigBroker
+from mply_ingester.db.models import ClientProduct
+from mply_ingester.web.search import LISTING_KEYS
+
+EXPORT_COLUMNS = ClientProduct.__table__.columns
+
+
+def _json_default(value: Any) -> Any:
+    # The same representation as the product list
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot export {type(value).__name__}")
+
+
+def _csv_chunks(batches: Iterator[List[Sequence[Any]]]) -> Iterator[bytes]:
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow([column.name for column in EXPORT_COLUMNS])
+    for batch in batches:
+        writer.writerows(batch)
+        yield output.getvalue().encode('utf-8')
+        output.seek(0)
+        output.truncate()
+    # The header alone, when there are no products
+    if output.tell():
+        yield output.getvalue().encode('utf-8')
+
+
+def _ndjson_chunks(batches: Iterator[List[Sequence[Any]]]) -> Iterator[bytes]:
+    names = [column.name for column in EXPORT_COLUMNS]
+    for batch in batches:
+        yield ''.join(json.dumps(dict(zip(names, row)), default=_json_default) + '\n' for row in batch).encode('utf-8')
+
+
+def _gzip_chunks(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)  # 31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+FORMATS = {
+    'csv': ('text/csv', _csv_chunks),
+    'ndjson': ('application/x-ndjson', _ndjson_chunks),
+}
+
+
+def export_products(config_broker: ConfigBroker, client_id: int, export_format: str, gzip: bool) -> Iterator[bytes]:
+    """
+    Stream all products of a client as chunks of CSV or NDJSON, optionally gzipped. The products are read through
+    a server side cursor EXPORT_BATCH_SIZE rows at a time, in their own session so the export can outlive the
+    request's dependencies.
+    """
+    _, serialize = FORMATS[export_format]
+    db = config_broker.get_session()
+    try:
+        result = db.execute(
+            select(*EXPORT_COLUMNS)
+            .where(ClientProduct.client_id == client_id)
+            .order_by(*LISTING_KEYS)
+            .execution_options(yield_per=config_broker['EXPORT_BATCH_SIZE'])
+        )
+        chunks = serialize(result.partitions())
+        yield from _gzip_chunks(chunks) if gzip else chunks
+    finally:
+        db.close()
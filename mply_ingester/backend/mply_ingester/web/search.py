@@ -0,0 +1,108 @@
+import base64
+import binascii
+import json
+from typing import Any, Dict, List, Sequence
+
+from sqlalchemy import Float, Integer, String, case, cast, func, or_, text
+from sqlalchemy.orm import Query, Session
+from sqlalchemy.sql import ColumnElement
+from sqlalchemy.types import TypeEngine
+
+from mply_ingester.db.models import ClientProduct
+
+
+class ProductSearch:
+    """
+    Filters a client's products by a search query and ranks them: exact SKU matches first, then SKUs starting
+    with the query, then the rest. Matches on title, remote_id or sku, ignoring case.
+    """
+
+    def filter(self, query: Query, q: str) -> Query:
+        return query.filter(or_(
+            ClientProduct.title.ilike(f"%{q}%"),
+            ClientProduct.remote_id.ilike(f"%{q}%"),
+            ClientProduct.sku.ilike(f"%{q}%")
+        ))
+
+    def rank_keys(self, q: str) -> List[ColumnElement]:
+        """The ascending sort keys of the ranking, ending with the unique (sku, id)"""
+        exact_match = case((func.lower(ClientProduct.sku) == func.lower(q), 0), else_=1)
+        prefix_match = case((ClientProduct.sku.ilike(f"{q}%"), 0), else_=1)
+        return [exact_match, prefix_match, ClientProduct.sku, ClientProduct.id]
+
+
+class TrigramProductSearch(ProductSearch):
+    """
+    Uses pg_trgm: the ILIKE filters are served by the trigram indexes of migration 004, and after the exact and
+    prefix SKU matches the rest is ranked by how similar it is to the query, rather than in SKU order as with
+    ProductSearch. SKU order only breaks ties.
+    """
+
+    def rank_keys(self, q: str) -> List[ColumnElement]:
+        exact_match, prefix_match, *unique_keys = super().rank_keys(q)
+        # greatest() ignores NULLs. Negated so every key sorts ascending, and cast from real to double precision
+        # so the value round-trips exactly through a cursor
+        dissimilarity = -cast(func.greatest(
+            func.similarity(ClientProduct.sku, q),
+            func.similarity(ClientProduct.title, q),
+            func.similarity(ClientProduct.remote_id, q),
+        ), Float)
+        return [exact_match, prefix_match, dissimilarity, *unique_keys]
+
+
+LISTING_KEYS = [ClientProduct.sku, ClientProduct.id]
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def encode_cursor(sort_key: Sequence[Any]) -> str:
+    """An opaque cursor pointing after the row with the given sort key"""
+    return base64.urlsafe_b64encode(json.dumps(list(sort_key)).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str, sort_keys: Sequence[ColumnElement]) -> List[Any]:
+    """
+    Raises:
+        InvalidCursorError: If the cursor was not made by encode_cursor for a row of sort_keys, such as a cursor
+            of another sort or one that was tampered with
+    """
+    try:
+        sort_key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, binascii.Error):
+        raise InvalidCursorError("Invalid cursor") from None
+    if not isinstance(sort_key, list) or len(sort_key) != len(sort_keys):
+        raise InvalidCursorError("Invalid cursor")
+    # Values the database would fail to compare with the keys must not get to it
+    if not all(_fits(value, key.type) for value, key in zip(sort_key, sort_keys)):
+        raise InvalidCursorError("Invalid cursor")
+    return sort_key
+
+
+# The range of the integer columns, the ids and ranks of the sort keys
+_INTEGER_MIN, _INTEGER_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+def _fits(value: Any, key_type: TypeEngine) -> bool:
+    if isinstance(key_type, Integer):
+        return type(value) is int and _INTEGER_MIN <= value <= _INTEGER_MAX
+    if isinstance(key_type, Float):
+        return type(value) in (int, float)
+    if isinstance(key_type, String):
+        return type(value) is str and '\x00' not in value
+    return False
+
+
+# Whether pg_trgm is installed, per database
+_trigram_available: Dict[str, bool] = {}
+
+
+def product_search_for(db: Session) -> ProductSearch:
+    """The trigram search if the database has pg_trgm installed, the plain ILIKE search otherwise"""
+    url = db.get_bind().url.render_as_string(hide_password=True)
+    if url not in _trigram_available:
+        _trigram_available[url] = db.scalar(
+            text("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+        )
+    return TrigramProductSearch() if _trigram_available[url] else ProductSearch()
@@ -0,0 +1,105 @@
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from mply_ingester.db.models import Client, User
+
+
+@dataclass(frozen=True)
+class CachedSession:
+    user_id: int
+    client_id: int
+    user_active: bool
+    client_active: bool
+
+
+class SessionTokenCache:
+    """
+    In-process LRU cache of session token -> CachedSession, so that authenticating a request needs no query.
+    Entries expire after ttl seconds. A commit of changed or deleted User or Client objects, such as a login, a
+    logout or a deactivation, forgets their tokens in every cache of the process. Changes made by other processes,
+    or by UPDATE statements that bypass the ORM objects, are only seen once the entries expire.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, CachedSession]] = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every forget, so that a lookup that raced with a commit does not store what it read before
+        self.generation = 0
+        _caches.add(self)
+
+    def get(self, token: str) -> Optional[CachedSession]:
+        with self._lock:
+            item = self._entries.get(token)
+            if item is None:
+                return None
+            expires_at, cached = item
+            if expires_at <= time.monotonic():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return cached
+
+    def put(self, token: str, cached: CachedSession, generation: int) -> None:
+        """Store what was read from the database while self.generation was generation"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[token] = (time.monotonic() + self.ttl, cached)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def forget(self, user_ids: set[int] = frozenset(), client_ids: set[int] = frozenset()) -> None:
+        with self._lock:
+            self.generation += 1
+            stale = [token for token, (_, cached) in self._entries.items()
+                     if cached.user_id in user_ids or cached.client_id in client_ids]
+            for token in stale:
+                del self._entries[token]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_caches: weakref.WeakSet[SessionTokenCache] = weakref.WeakSet()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_accounts(session: Session, flush_context) -> None:
+    if not _caches:
+        return
+    for instance in (*session.dirty, *session.deleted):
+        if isinstance(instance, User):
+            session.info.setdefault('changed_user_ids', set()).add(instance.id)
+        elif isinstance(instance, Client):
+            session.info.setdefault('changed_client_ids', set()).add(instance.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _forget_changed_accounts(session: Session) -> None:
+    # Forgotten only once committed, a lookup running before that still reads the old state
+    user_ids = session.info.pop('changed_user_ids', set())
+    client_ids = session.info.pop('changed_client_ids', set())
+    if user_ids or client_ids:
+        for cache in list(_caches):
+            cache.forget(user_ids, client_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_accounts(session: Session) -> None:
+    # The changes are gone, a later commit of the session has nothing to forget. A rolled back savepoint keeps them,
+    # the ids flushed before it are still to be committed
+    if not session.in_nested_transaction():
+        session.info.pop('changed_user_ids', None)
+        session.info.pop('changed_client_ids', None)